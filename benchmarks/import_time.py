@@ -0,0 +1,58 @@
+"""
+Measures how long a fresh interpreter takes to import the CLI and worker modules, which is paid by every worker process
+that re-imports them, and whether doing so pulls in pandas.
+
+Usage: python benchmarks/import_time.py [--runs N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ["main", "src.services", "src.counters", "pandas"]
+HEAVY_MODULES = ["pandas", "numpy", "sqlalchemy"]
+
+
+def time_import(module: str, runs: int) -> float:
+    """Returns the median wall time (in seconds) of starting an interpreter and importing the module"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def heavy_imports(module: str) -> list[str]:
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = time_import("sys", args.runs)
+    print(f"{'module':<15} {'import (ms)':>12}  heavy modules loaded")
+    for module in MODULES:
+        elapsed = time_import(module, args.runs) - baseline
+        heavy = ", ".join(heavy_imports(module)) or "-"
+        print(f"{module:<15} {elapsed * 1000:>12.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
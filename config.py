@@ -12,3 +12,4 @@ class Config:
     OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
     PREPROCESSED_DIR = OUTPUT_DIR / "preprocessed"
     PROCESSED_DIR = OUTPUT_DIR / "processed"
+    DATABASE_PATH = Path(os.getenv("DATABASE_PATH", OUTPUT_DIR / "results.db"))
@@ -1,17 +1,37 @@
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from functools import partial
 
 import click
-import pandas as pd
 
 from config import Config
-from src.counters import AcquiaCounter, DailyTrafficCounter
+from src.counters import (
+    AcquiaCounter,
+    DailyTrafficCounter,
+    PerformanceCounter,
+    RollupCounter,
+    TopKCounter,
+)
+from src.reports import ReportCollector
+from src.sampling import VisitorSampler
 from src.services import threaded_count_log_entries
 from src.utils import gather_domains, gather_files, timeit
 
+# NB: pandas, sqlalchemy and the modules depending on them are imported within the commands that need them, so that
+# the CLI (and every worker process that re-imports this module) starts up without them
+
 SRC_DIR = Config.SRC_DIR
 OUTPUT_DIR = Config.OUTPUT_DIR
 PREPROCESSED_DIR = Config.PREPROCESSED_DIR
 PROCESSED_DIR = Config.PROCESSED_DIR
+DATABASE_PATH = Config.DATABASE_PATH
+
+VISIT_COUNTERS = {"acquia": AcquiaCounter, "daily-traffic": DailyTrafficCounter}
+COUNTERS = {
+    **VISIT_COUNTERS,
+    "performance": PerformanceCounter,
+    "top-k": TopKCounter,
+}
 
 
 @click.group()
@@ -19,41 +39,180 @@ def cli():
     pass
 
 
+def prompt_counter() -> tuple[str]:
+    """Asks which counter to use, for when none was given on the command line"""
+    return (
+        click.prompt(
+            "Which counter should be used?", type=click.Choice(list(COUNTERS))
+        ),
+    )
+
+
+def validate_options(
+    counter: tuple[str, ...],
+    output: tuple[str, ...],
+    rollup: bool,
+    sample: float,
+    engine: str = "record",
+):
+    if engine == "batch" and (
+        rollup or any(name not in VISIT_COUNTERS for name in counter)
+    ):
+        raise click.UsageError(
+            f"--engine batch can only be used with the {', '.join(VISIT_COUNTERS)} counters and without --rollup"
+        )
+    if engine == "batch":
+        from src.batch import BatchParser
+
+        try:
+            BatchParser(Config.LOG_FORMAT)
+        except (RuntimeError, ValueError) as e:
+            raise click.ClickException(str(e))
+    if sample < 1 and (rollup or "sqlite" in output):
+        raise click.UsageError("--sample can only be used with csv output")
+    if sample < 1 and any(name not in VISIT_COUNTERS for name in counter):
+        raise click.UsageError(
+            f"--sample can only be used with the {', '.join(VISIT_COUNTERS)} counters"
+        )
+    if sample < 1:
+        try:
+            VisitorSampler(sample, Config.LOG_FORMAT)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+
+def build_counter_classes(counter: tuple[str, ...], rollup: bool) -> list:
+    """Returns the counter classes to run over each log file, with a rollup for each visit counter if requested"""
+    names = list(dict.fromkeys(counter))
+    counter_classes = [COUNTERS[name] for name in names]
+    if rollup:
+        counter_classes += [
+            partial(RollupCounter, VISIT_COUNTERS[name])
+            for name in names
+            if name in VISIT_COUNTERS
+        ]
+    return counter_classes
+
+
+def write_results(
+    domain: str, collector: ReportCollector, output: tuple[str, ...], counter_dir
+):
+    """Writes the combined report of each counter collected for a domain to the requested outputs"""
+    from src import database
+    from src.handlers import CSVFileHandler, SQLiteHandler
+
+    for counter_obj, df in collector.results():
+        if isinstance(counter_obj, RollupCounter):
+            engine = database.get_engine(DATABASE_PATH)
+            n_rows = database.upsert_rollups(
+                engine, counter_obj.name, counter_obj.rollups()
+            )
+            print(f"Rollups Stored: {DATABASE_PATH.name} ({n_rows:,} rows)")
+            continue
+        if len(df) == 0:
+            continue
+        # only visit counts can be stored in the results database, so anything else always goes to csv
+        storable = counter_obj.name in VISIT_COUNTERS
+        if "csv" in output or not storable:
+            report_name = f"{domain}-{counter_obj.name}"
+            if collector.sample_rate < 1:
+                report_name = f"{report_name}-sample"
+            report_file = counter_dir / f"{report_name}.csv"
+            CSVFileHandler(report_file).handle_output(df)
+            print(f"Report Created: {report_file.name}")
+        if "sqlite" in output and storable:
+            SQLiteHandler(DATABASE_PATH, counter_obj.name).handle_output(df)
+            print(f"Results Stored: {DATABASE_PATH.name} ({len(df):,} rows)")
+
+
 @cli.command()
 @click.option(
     "-c",
     "--counter",
-    type=click.Choice(["acquia", "daily-traffic"]),
-    prompt="Which counter should be used?",
-    help="The counting method to use for analysis.",
+    type=click.Choice(list(COUNTERS)),
+    multiple=True,
+    help="The counting method to use for analysis. May be given more than once to run several counters in one pass.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Choice(["csv", "sqlite"]),
+    multiple=True,
+    default=["csv"],
+    show_default=True,
+    help="Where to write the results. May be given more than once.",
+)
+@click.option(
+    "--rollup/--no-rollup",
+    default=False,
+    help="Also store an hourly rollup cube of views and distinct visitors in the results database.",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=1.0,
+    metavar="RATE",
+    help="Only count this fraction of visitors, scaling up the results to estimates with 95% confidence intervals.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["record", "batch"]),
+    default="record",
+    show_default=True,
+    help="Count each log file one record at a time, or in vectorized batches (visit counters only).",
 )
 @click.argument("domains", nargs=-1)
 @timeit
-def analyze(counter: str, domains: tuple[str, ...]):
+def analyze(
+    counter: tuple[str, ...],
+    output: tuple[str, ...],
+    rollup: bool,
+    sample: float,
+    engine: str,
+    domains: tuple[str, ...],
+):
     """
     Parse log files for the given domains, returning counts of views and visitors by day.
 
-    The methodology used depends upon the type of counter that is chosen. Currently, only two counters are implemented:
+    The methodology used depends upon the type of counter that is chosen. Currently, the following counters are
+    implemented:
 
         :Acquia: Filters and counts traffic according to the methodology outlined by Acquia.
 
         :Daily Traffic: Filters and counts daily traffic with unique client/user agent combinations.
+
+        :Performance: Tracks requests, bytes sent and p50/p95/p99 request durations per hour.
+
+        :Top K: Tracks the most requested URIs and busiest remote hosts and user agents per day.
+
+    Results are written to a csv per domain in the output folder and/or upserted into the results database. With
+    --rollup, an hourly rollup cube is also stored so that day, week and month reports can be derived later with the
+    rollup-report command.
+
+    With --sample, visitors are selected by a hash of their remote host and user agent before their lines are parsed,
+    so a sample of 0.01 parses roughly 1% of the logs. Sampled estimates are only written to csv.
+
+    With --engine batch, each log file is parsed, filtered and counted in vectorized batches rather than one record at
+    a time. The results are identical, but it only supports the visit counters.
     """
+    if not counter:
+        counter = prompt_counter()
+    validate_options(counter, output, rollup, sample, engine)
+
     # administrative tasks
     print(f"Scanning source directory: {SRC_DIR}")
     domains = gather_domains(domains, SRC_DIR)
     counter_dir = OUTPUT_DIR / "counts"
     counter_dir.mkdir(parents=True, exist_ok=True)
-    counter_map = {"acquia": AcquiaCounter, "daily-traffic": DailyTrafficCounter}
-    counter_class = counter_map[counter]
+    counter_classes = build_counter_classes(counter, rollup)
 
-    # iterate over each domain, parsing the logs via a thread pool,
-    # collecting the results into a dataframe, and writing the collected
-    # results to the output folder
-    for domain in domains:
-        print(f"Parsing domain: {domain.name}")
-        df = pd.DataFrame()
-        with ProcessPoolExecutor() as ex:
+    # iterate over each domain, parsing the logs via a process pool shared across domains,
+    # collecting the per-file counters into one report per counter, and writing the
+    # collected results to the output folder
+    with ProcessPoolExecutor() as ex:
+        for domain in domains:
+            print(f"Parsing domain: {domain.name}")
+            collector = ReportCollector(sample_rate=sample)
             futures = {}
             for file in gather_files(domain):
                 print(f"  - Submitted for processing: {file.name}")
@@ -61,29 +220,379 @@ def analyze(counter: str, domains: tuple[str, ...]):
                     threaded_count_log_entries,
                     logfile=file,
                     log_format=Config.LOG_FORMAT,
-                    counter_class=counter_class,
+                    counter_classes=counter_classes,
+                    sample_rate=sample,
+                    engine=engine,
                 )
                 futures[future] = file
             for future in as_completed(futures):
                 file = futures[future]
                 try:
-                    counter_obj = future.result()
+                    counters = future.result()
                 except Exception as e:
                     print(f"{file.name} raised an exception: {e}")
                 else:
-                    report = counter_obj.report()
-                    total_visits = report.visits.sum()
-                    total_views = report.views.sum()
+                    collector.add(counters)
+                    summary = "; ".join(
+                        f"{c.name}: {c.visits:,} visits, {c.views:,} views"
+                        for c in counters
+                        if not c.mergeable
+                    )
                     print(
-                        f"  - Processed: {file.name} ({total_visits:,} visits; {total_views:,} views)"
+                        f"  - Processed: {file.name}"
+                        + (f" ({summary})" if summary else "")
                     )
-                    df = pd.concat([df, counter_obj.report()])
+            write_results(domain.name, collector, output, counter_dir)
 
-        if len(df) > 0:
-            report_file = counter_dir / f"{domain.name}-{counter_obj.name}.csv"
-            df = df.groupby(["domain", "date"]).sum(numeric_only=False)
-            df.to_csv(report_file)
-            print(f"Report Created: {report_file.name}")
+
+@cli.command("watch")
+@click.option(
+    "-c",
+    "--counter",
+    type=click.Choice(list(VISIT_COUNTERS)),
+    prompt="Which counter should be used?",
+    help="The counting method to use for analysis.",
+)
+@click.option(
+    "-i",
+    "--interval",
+    type=click.FloatRange(min=0),
+    default=60,
+    show_default=True,
+    help="How often (in seconds) to flush updated counts to the results database.",
+)
+@click.option(
+    "--poll",
+    type=click.FloatRange(min=0),
+    default=1,
+    show_default=True,
+    help="How long (in seconds) to wait before checking for new lines when the logs are idle.",
+)
+@click.argument("domains", nargs=-1)
+def watch_domains(counter: str, interval: float, poll: float, domains: tuple[str, ...]):
+    """
+    Follow the current uncompressed log of each domain, counting new lines as they are written.
+
+    Updated counts are upserted into the results database every interval, and the read position of each domain is
+    saved alongside, so restarting the command resumes from where it left off. Stop watching with Ctrl+C.
+    """
+    from src.handlers import SQLiteHandler
+    from src.tail import LogWatcher, watch
+
+    print(f"Scanning source directory: {SRC_DIR}")
+    domains = gather_domains(domains, SRC_DIR)
+    counter_class = VISIT_COUNTERS[counter]
+    handler = SQLiteHandler(DATABASE_PATH, counter_class.name)
+    state_dir = OUTPUT_DIR / "watch"
+    watchers = []
+    for domain in domains:
+        print(f"Watching domain: {domain.name}")
+        state_file = state_dir / f"{domain.name}-{counter_class.name}.pickle"
+        watchers.append(LogWatcher(domain, counter_class, handler, state_file))
+    try:
+        watch(watchers, flush_interval=interval, poll_interval=poll)
+    except KeyboardInterrupt:
+        print("Stopped watching; counts flushed.")
+
+
+@cli.command()
+@click.option(
+    "-c",
+    "--counter",
+    type=click.Choice(list(VISIT_COUNTERS)),
+    help="Only return results for the given counter.",
+)
+@click.option(
+    "--start",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only return results on or after this date (YYYY-MM-DD).",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only return results before this date (YYYY-MM-DD).",
+)
+@click.option(
+    "--csv",
+    "csv_file",
+    type=click.Path(dir_okay=False),
+    help="Write the results to this csv file instead of stdout.",
+)
+@click.argument("domains", nargs=-1)
+def query(
+    counter: str,
+    start: datetime,
+    end: datetime,
+    csv_file: str,
+    domains: tuple[str, ...],
+):
+    """
+    Query the results database for stored counts, optionally limited to the given domains.
+    """
+    import pandas as pd
+
+    from src import database
+
+    engine = database.get_engine(DATABASE_PATH)
+    rows = database.query_counts(
+        engine,
+        domains=domains,
+        counter=counter,
+        start=start.date() if start else None,
+        end=end.date() if end else None,
+    )
+    df = pd.DataFrame(
+        rows, columns=["domain", "counter", "date", "hour", "visits", "views"]
+    )
+    if csv_file:
+        df.to_csv(csv_file, index=False)
+        print(f"{len(df):,} rows written to {csv_file}")
+    else:
+        print(df.to_string(index=False))
+
+
+@cli.command("rollup-report")
+@click.option(
+    "-c",
+    "--counter",
+    type=click.Choice(list(VISIT_COUNTERS)),
+    prompt="Which counter's rollups should be used?",
+    help="The counting method the rollups were built with.",
+)
+@click.option(
+    "-g",
+    "--granularity",
+    type=click.Choice(["hour", "day", "week", "month"]),
+    default="day",
+    show_default=True,
+    help="The period to aggregate the rollups by.",
+)
+@click.option(
+    "--start",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only include rollups on or after this date (YYYY-MM-DD).",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only include rollups before this date (YYYY-MM-DD).",
+)
+@click.option(
+    "--csv",
+    "csv_file",
+    type=click.Path(dir_okay=False),
+    help="Write the report to this csv file instead of stdout.",
+)
+@click.argument("domains", nargs=-1)
+def rollup_report(
+    counter: str,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    csv_file: str,
+    domains: tuple[str, ...],
+):
+    """
+    Report views and visitors per hour, day, week or month from the stored rollups, without reparsing any logs.
+
+    Visitors are the estimated distinct remote host + user agent combinations over each period, while hourly visitors
+    sum the distinct visitors of each hour (as the Acquia counter does).
+    """
+    import pandas as pd
+
+    from src import database
+
+    engine = database.get_engine(DATABASE_PATH)
+    rows = database.rollup_report(
+        engine,
+        counter,
+        granularity=granularity,
+        domains=domains,
+        start=start.date() if start else None,
+        end=end.date() if end else None,
+    )
+    df = pd.DataFrame(
+        rows,
+        columns=["domain", "date", "hour", "views", "visitors", "hourly_visitors"],
+    )
+    if granularity != "hour":
+        df = df.drop(columns="hour")
+    if csv_file:
+        df.to_csv(csv_file, index=False)
+        print(f"{len(df):,} rows written to {csv_file}")
+    else:
+        print(df.to_string(index=False))
+
+
+@cli.group("queue")
+def queue_group():
+    """
+    Spread an analysis across several worker processes or nodes via a queue directory on shared storage.
+
+    Submit the log files of some domains to a queue, start any number of workers (on any node that mounts the same
+    storage at the same path), then merge the workers' partial results into the per-domain reports:
+
+        python main.py queue submit QUEUE_DIR --counter acquia all
+
+        python main.py queue worker QUEUE_DIR
+
+        python main.py queue merge QUEUE_DIR
+    """
+
+
+@queue_group.command("submit")
+@click.option(
+    "-c",
+    "--counter",
+    type=click.Choice(list(COUNTERS)),
+    multiple=True,
+    help="The counting method to use for analysis. May be given more than once to run several counters in one pass.",
+)
+@click.option(
+    "--rollup/--no-rollup",
+    default=False,
+    help="Also build an hourly rollup cube of views and distinct visitors.",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=1.0,
+    metavar="RATE",
+    help="Only count this fraction of visitors, scaling up the results to estimates with 95% confidence intervals.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["record", "batch"]),
+    default="record",
+    show_default=True,
+    help="Count each log file one record at a time, or in vectorized batches (visit counters only).",
+)
+@click.argument("queue_dir", type=click.Path(file_okay=False))
+@click.argument("domains", nargs=-1)
+def queue_submit(
+    counter: tuple[str, ...],
+    rollup: bool,
+    sample: float,
+    engine: str,
+    queue_dir: str,
+    domains: tuple[str, ...],
+):
+    """
+    Write a manifest of jobs, one per log file of the given domains, to a new queue directory.
+    """
+    from src.workqueue import WorkQueue
+
+    if not counter:
+        counter = prompt_counter()
+    validate_options(counter, (), rollup, sample, engine)
+    print(f"Scanning source directory: {SRC_DIR}")
+    files = {
+        domain.name: list(gather_files(domain))
+        for domain in gather_domains(domains, SRC_DIR)
+    }
+    settings = {
+        "counters": list(dict.fromkeys(counter)),
+        "rollup": rollup,
+        "sample": sample,
+        "engine": engine,
+        "log_format": Config.LOG_FORMAT,
+    }
+    try:
+        queue = WorkQueue.create(queue_dir, files, settings)
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    print(f"Submitted {len(queue.jobs):,} jobs for {len(files):,} domains")
+
+
+@queue_group.command("worker")
+@click.option(
+    "--lease",
+    type=click.FloatRange(min=1),
+    default=300,
+    show_default=True,
+    help="Seconds (by the shared filesystem's clock) after which a job whose worker stopped renewing its lock may be taken over.",
+)
+@click.option(
+    "--wait/--no-wait",
+    default=False,
+    help="Keep polling until every job is finished, taking over any from dead workers.",
+)
+@click.argument("queue_dir", type=click.Path(exists=True, file_okay=False))
+@timeit
+def queue_worker(lease: float, wait: bool, queue_dir: str):
+    """
+    Claim and process jobs from the queue until there are none left to claim.
+    """
+    from src.workqueue import WorkQueue, run_worker
+
+    queue = WorkQueue(queue_dir, lease_seconds=lease)
+    settings = queue.settings
+    n_jobs = run_worker(
+        queue,
+        counter_classes=build_counter_classes(
+            tuple(settings["counters"]), settings["rollup"]
+        ),
+        log_format=settings["log_format"],
+        sample_rate=settings["sample"],
+        engine=settings.get("engine", "record"),
+        wait=wait,
+    )
+    print(f"Worker finished after processing {n_jobs:,} jobs")
+
+
+@queue_group.command("status")
+@click.argument("queue_dir", type=click.Path(exists=True, file_okay=False))
+def queue_status(queue_dir: str):
+    """
+    Show how many of the queue's jobs are pending, claimed, done or failed.
+    """
+    from src.workqueue import WorkQueue
+
+    queue = WorkQueue(queue_dir)
+    for state, count in queue.status().items():
+        print(f"{state}: {count:,}")
+    for job, error in queue.errors():
+        print(f"\nJob {job.id} ({job.file}) failed:\n{error}")
+
+
+@queue_group.command("merge")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Choice(["csv", "sqlite"]),
+    multiple=True,
+    default=["csv"],
+    show_default=True,
+    help="Where to write the results. May be given more than once.",
+)
+@click.argument("queue_dir", type=click.Path(exists=True, file_okay=False))
+def queue_merge(output: tuple[str, ...], queue_dir: str):
+    """
+    Merge the partial results of a finished queue into the per-domain reports.
+    """
+    from src.workqueue import WorkQueue
+
+    queue = WorkQueue(queue_dir)
+    settings = queue.settings
+    validate_options(
+        tuple(settings["counters"]), output, settings["rollup"], settings["sample"]
+    )
+    status = queue.status()
+    if status["pending"] or status["claimed"]:
+        raise click.ClickException(
+            f"The queue isn't finished yet ({status['pending']:,} pending, {status['claimed']:,} claimed)"
+        )
+    if status["failed"]:
+        print(f"Warning: {status['failed']:,} jobs failed; see `queue status`")
+
+    counter_dir = OUTPUT_DIR / "counts"
+    counter_dir.mkdir(parents=True, exist_ok=True)
+    for domain in dict.fromkeys(job.domain for job in queue.jobs):
+        print(f"Merging domain: {domain}")
+        collector = ReportCollector(sample_rate=settings["sample"])
+        for counters in queue.results(domain):
+            collector.add(counters)
+        write_results(domain, collector, output, counter_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+"""
+This module implements a batch engine, which parses, filters and counts log lines in chunks rather than one
+LogRecord at a time.
+
+Each batch of lines is matched against the same regex apachelogs builds for the log format, and the fields the
+counters need are gathered into columns. Every distinct value is converted only once (with apachelogs' own
+converters), the counters' filters are applied as vectorized masks, and the visit/view group-by is done with
+NumPy before being merged into the counters' data. The results are identical to counting with the per-record engine
+in src.services.
+"""
+import re
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+from urllib.parse import urlparse
+
+import apachelogs
+import numpy as np
+import pandas as pd
+from apachelogs import LogParser
+
+from config import Config
+from src.counters import AbstractCounter
+from src.utils import domain_from_filename, split_request_line
+
+BATCH_SIZE = 50_000
+
+
+def map_unique(values: np.ndarray, func: Callable) -> np.ndarray:
+    """
+    Applies func to each distinct value of the array only once, returning an object array of the results.
+
+    Missing values are returned as None, and func may return None for values it can't convert.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    for i, value in enumerate(uniques):
+        mapped[i] = func(value)
+    mapped[-1] = None
+    return mapped[codes]
+
+
+def _parse_request_line(request_line: str) -> tuple[Optional[str], Optional[str]]:
+    """Returns the method and uri path of the request line, or None for either if they can't be parsed"""
+    try:
+        method, uri, _ = split_request_line(request_line)
+    except ValueError:
+        return None, None
+    try:
+        return method, urlparse(uri).path
+    except ValueError:
+        return method, None
+
+
+class BatchParser:
+    """Parses batches of raw log lines into a DataFrame with a column for each field used by the counters"""
+
+    # the attribute each column is stored under on an apachelogs LogEntry
+    fields = {
+        "remote_host": "remote_host",
+        "request_time": ("request_time_fields", "timestamp"),
+        "request_line": "request_line",
+        "status": "status",
+        "user_agent": ("headers_in", "user-agent"),
+    }
+
+    def __init__(self, log_format: str = Config.LOG_FORMAT):
+        parser = LogParser(log_format)
+        self.regex, group_defs = self._internals(parser)
+        self.encoding = parser.encoding
+        self.errors = parser.errors or "strict"
+        names = [
+            name.lower() if isinstance(name, str) else tuple(n.lower() for n in name)
+            for name, _, _ in group_defs
+        ]
+        self.groups = {}
+        for column, name in self.fields.items():
+            name = (
+                name.lower()
+                if isinstance(name, str)
+                else tuple(n.lower() for n in name)
+            )
+            if name not in names:
+                raise ValueError(f"The log format has no directive for {column}")
+            index = names.index(name)
+            self.groups[column] = (index, group_defs[index][2])
+
+    @staticmethod
+    def _internals(parser: LogParser) -> tuple[re.Pattern, list[tuple]]:
+        """
+        Returns the compiled regex and (name, directive, converter) group definitions of an apachelogs LogParser.
+
+        These are private to apachelogs (checked against 0.6.x, which the Pipfile pins), so rather than risk
+        miscounting, an error is raised should they be missing or have a different shape.
+        """
+        regex = getattr(parser, "_rgx", None)
+        group_defs = getattr(parser, "_group_defs", None)
+        if (
+            not isinstance(regex, re.Pattern)
+            or not isinstance(group_defs, list)
+            or regex.groups != len(group_defs)
+            or not all(
+                isinstance(group, tuple) and len(group) == 3 and callable(group[2])
+                for group in group_defs
+            )
+        ):
+            raise RuntimeError(
+                f"The batch engine doesn't support apachelogs {apachelogs.__version__}; use the record engine"
+            )
+        return regex, group_defs
+
+    def _converter(self, column: str) -> Callable:
+        _, convert = self.groups[column]
+
+        def func(raw: str):
+            value = convert(raw)
+            if isinstance(value, bytes):
+                value = value.decode(self.encoding, self.errors)
+            return value
+
+        return func
+
+    def _safe_converter(self, column: str) -> Callable:
+        func = self._converter(column)
+
+        def safe_func(raw: str):
+            try:
+                return func(raw)
+            except ValueError:
+                return None
+
+        return safe_func
+
+    def parse(self, filename: str, lines: list[str]) -> pd.DataFrame:
+        matches = [self.regex.fullmatch(line.rstrip("\r\n")) for line in lines]
+        groups = [m.groups() for m in matches if m is not None]
+        columns = {}
+        for column, (index, _) in self.groups.items():
+            raw = np.empty(len(groups), dtype=object)
+            raw[:] = [g[index] for g in groups]
+            if column == "request_time":
+                # lines whose timestamp can't be converted are rejected, as they are by LogParser.parse
+                columns[column] = map_unique(raw, self._safe_converter(column))
+            else:
+                columns[column] = map_unique(raw, self._converter(column))
+        request_lines = map_unique(columns["request_line"], _parse_request_line)
+        columns["method"] = np.array(
+            [x[0] if x else None for x in request_lines], dtype=object
+        )
+        columns["path"] = np.array(
+            [x[1] if x else None for x in request_lines], dtype=object
+        )
+        batch = pd.DataFrame(columns, dtype=object)
+        batch = batch[batch["request_time"].notna()]
+        batch.insert(0, "domain", domain_from_filename(filename))
+        return batch
+
+
+def count_batch(counter: AbstractCounter, batch: pd.DataFrame):
+    """Applies the counter's filters to the batch as masks, and adds the counts of each key to its data"""
+    mask = np.ones(len(batch), dtype=bool)
+    for f in counter.filters:
+        mask &= f.mask(batch).to_numpy(dtype=bool)
+    rows = batch[mask]
+    if len(rows) == 0:
+        return
+    codes, uniques = [], []
+    for field in counter.fields:
+        values = rows[field].to_numpy(dtype=object)
+        if field in counter.adapters:
+            values = map_unique(values, counter.adapters[field])
+        field_codes, field_uniques = pd.factorize(values)
+        codes.append(field_codes)
+        # missing values are coded as -1, which indexes the trailing None
+        uniques.append(list(field_uniques) + [None])
+    keys, counts = np.unique(np.column_stack(codes), axis=0, return_counts=True)
+    counter.data.update(
+        Counter(
+            {
+                tuple(
+                    field_uniques[code] for field_uniques, code in zip(uniques, key)
+                ): int(n)
+                for key, n in zip(keys, counts)
+            }
+        )
+    )
+
+
+def batch_count_log_entries(
+    logfile: Union[str, Path],
+    counters: list[AbstractCounter],
+    log_format: str = Config.LOG_FORMAT,
+    sampler: Optional[Callable[[str], bool]] = None,
+    batch_size: int = BATCH_SIZE,
+):
+    """Batch engine equivalent of services.count_log_entries"""
+    from src.services import read_logfile
+
+    for counter in counters:
+        if counter.mergeable:
+            raise ValueError(
+                f"The {counter.name} counter doesn't support the batch engine"
+            )
+    logfile = Path(logfile)
+    parser = BatchParser(log_format)
+    lines: Iterable[str] = read_logfile(logfile)
+    if sampler is not None:
+        lines = filter(sampler, lines)
+    while batch_lines := list(islice(lines, batch_size)):
+        batch = parser.parse(logfile.name, batch_lines)
+        for counter in counters:
+            count_batch(counter, batch)
@@ -1,12 +1,20 @@
 from abc import ABC
 from collections import Counter
-from datetime import datetime
-from typing import Iterable
-
-import pandas as pd
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Any, Iterable
 
 from src import filters
 from src.models import LogRecord
+from src.sketches import DDSketch, HyperLogLog, SpaceSaving
+
+if TYPE_CHECKING:
+    # pandas is only imported when a report is built, keeping the counting path (and workers) light
+    import pandas as pd
+
+
+def _to_date(value: date) -> date:
+    return value.date() if isinstance(value, datetime) else value
 
 
 class AbstractCounter(ABC):
@@ -14,6 +22,8 @@ class AbstractCounter(ABC):
     filters: list[filters.Filter]
     fields: list[str]
     adapters: {}
+    # whether the counters of each file are merged before reporting, rather than summing their reports
+    mergeable: bool = False
 
     def __init__(self):
         self.data = Counter()
@@ -37,8 +47,24 @@ class AbstractCounter(ABC):
             attrs.append(value)
         self.data[tuple(attrs)] += 1
 
+    def merge(self, other: "AbstractCounter") -> "AbstractCounter":
+        """Folds the data of another counter of the same type into this one"""
+        self.data.update(other.data)
+        return self
+
     def reset(self):
-        self.data = set()
+        self.data = Counter()
+
+    def evict_before(self, cutoff: date):
+        """Drops any data for periods before the cutoff date, keeping memory bounded when counting continuously"""
+        index = self.fields.index("request_time")
+        self.data = Counter(
+            {
+                keys: views
+                for keys, views in self.data.items()
+                if _to_date(keys[index]) >= cutoff
+            }
+        )
 
     @property
     def views(self) -> int:
@@ -56,7 +82,9 @@ class AbstractCounter(ABC):
             row["views"] = views
             yield row
 
-    def to_df(self) -> pd.DataFrame:
+    def to_df(self) -> "pd.DataFrame":
+        import pandas as pd
+
         if len(self.data) == 0:
             df = pd.DataFrame(columns=self.fields + ["views"])
         else:
@@ -65,7 +93,7 @@ class AbstractCounter(ABC):
             df["request_time"] = pd.to_datetime(df.request_time)
         return df
 
-    def report(self) -> pd.DataFrame:
+    def report(self) -> "pd.DataFrame":
         raise NotImplementedError
 
 
@@ -85,7 +113,7 @@ class AcquiaCounter(AbstractCounter):
     fields = ["domain", "request_time", "remote_host", "user_agent"]
     adapters = {"request_time": lambda x: datetime(x.year, x.month, x.day, x.hour)}
 
-    def report(self) -> pd.DataFrame:
+    def report(self) -> "pd.DataFrame":
         """Aggregates visits & views by hour"""
         df = self.to_df()
         grouped = df.groupby(["domain", df.request_time.dt.to_period("D")]).agg(
@@ -118,7 +146,7 @@ class DailyTrafficCounter(AbstractCounter):
     fields = ["domain", "request_time", "remote_host", "user_agent"]
     adapters = {"request_time": lambda x: x.date()}
 
-    def report(self) -> pd.DataFrame:
+    def report(self) -> "pd.DataFrame":
         """Generates a report with columns 'domain', 'date', 'visits', 'views'"""
         df = self.to_df()
         grouped = df.groupby(["domain", "request_time"]).agg(
@@ -131,3 +159,277 @@ class DailyTrafficCounter(AbstractCounter):
             inplace=True,
         )
         return grouped
+
+
+class MergeableCounter(AbstractCounter):
+    """
+    A base class for counters whose data maps each key to a mergeable summary (e.g. a sketch), rather than counting
+    views per visitor.
+
+    Keys start with the domain followed by the date (or datetime) they summarize, and each summary has a `merge`
+    method folding another summary of the same key into it. As there is no per-visitor data, such counters can only
+    be reported with `report`.
+    """
+
+    mergeable = True
+
+    def __init__(self):
+        super().__init__()
+        self.data: dict[tuple, Any] = {}
+
+    def merge(self, other: "MergeableCounter") -> "MergeableCounter":
+        for key, summary in other.data.items():
+            if key in self.data:
+                self.data[key].merge(summary)
+            else:
+                self.data[key] = summary
+        return self
+
+    def reset(self):
+        self.data = {}
+
+    def evict_before(self, cutoff: date):
+        self.data = {
+            key: summary
+            for key, summary in self.data.items()
+            if _to_date(key[1]) >= cutoff
+        }
+
+    @property
+    def views(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def visits(self) -> int:
+        raise TypeError(f"The {self.name} counter doesn't count visits")
+
+    @property
+    def flattened_data(self) -> Iterable[dict]:
+        raise TypeError(
+            f"The {self.name} counter has no per-visitor data; use report() instead"
+        )
+
+    def to_df(self) -> "pd.DataFrame":
+        raise TypeError(
+            f"The {self.name} counter has no per-visitor data; use report() instead"
+        )
+
+
+@dataclass
+class Rollup:
+    """Views and a distinct visitor sketch for a single domain and period"""
+
+    views: int = 0
+    visitors: HyperLogLog = field(default_factory=HyperLogLog)
+
+    def merge(self, other: "Rollup") -> "Rollup":
+        self.views += other.views
+        self.visitors.merge(other.visitors)
+        return self
+
+
+class RollupCounter(MergeableCounter):
+    """
+    A counter class which builds an hourly rollup cube per domain, using the filters of another counter.
+
+    Each hour keeps its views alongside a HyperLogLog sketch of its distinct remote host + user agent combinations.
+    Because the sketches can be merged, day, week and month visitor counts can be derived from the stored cube
+    without reparsing the logs.
+    """
+
+    def __init__(self, base: type[AbstractCounter]):
+        super().__init__()
+        self.name = base.name
+        self.filters = base.filters
+        self.data: dict[tuple[str, date, int], Rollup] = {}
+
+    def add_entry(self, record: LogRecord):
+        request_time = record.request_time
+        key = (record.domain, request_time.date(), request_time.hour)
+        rollup = self.data.get(key)
+        if rollup is None:
+            rollup = self.data[key] = Rollup()
+        rollup.views += 1
+        rollup.visitors.add(f"{record.remote_host} {record.user_agent}")
+
+    @property
+    def views(self) -> int:
+        return sum(rollup.views for rollup in self.data.values())
+
+    @property
+    def visits(self) -> int:
+        return sum(rollup.visitors.count() for rollup in self.data.values())
+
+    def rollups(self) -> Iterable[dict]:
+        """Yields a row for each hour in the cube, along with a merged row for each day (with `hour` set to None)"""
+        days: dict[tuple[str, date], Rollup] = {}
+        for (domain, day, hour), rollup in sorted(self.data.items()):
+            visitors = rollup.visitors.count()
+            yield {
+                "domain": domain,
+                "date": day,
+                "hour": hour,
+                "views": rollup.views,
+                "visitors": visitors,
+                "hourly_visitors": visitors,
+                "sketch": rollup.visitors.to_bytes(),
+            }
+            total, hourly_visitors = days.get((domain, day), (None, 0))
+            if total is None:
+                total = Rollup(visitors=HyperLogLog(rollup.visitors.precision))
+            days[(domain, day)] = (total.merge(rollup), hourly_visitors + visitors)
+        for (domain, day), (total, hourly_visitors) in days.items():
+            yield {
+                "domain": domain,
+                "date": day,
+                "hour": None,
+                "views": total.views,
+                "visitors": total.visitors.count(),
+                "hourly_visitors": hourly_visitors,
+                "sketch": total.visitors.to_bytes(),
+            }
+
+    def report(self) -> "pd.DataFrame":
+        """Generates a report with columns 'domain', 'date', 'hour', 'visitors', 'views'"""
+        import pandas as pd
+
+        columns = ["domain", "date", "hour", "visitors", "views"]
+        rows = [row for row in self.rollups() if row["hour"] is not None]
+        return pd.DataFrame(rows, columns=columns + ["hourly_visitors", "sketch"])[
+            columns
+        ]
+
+
+@dataclass
+class RequestStats:
+    """Request count, bytes sent and a request duration sketch for a single domain and hour"""
+
+    requests: int = 0
+    bytes_sent: int = 0
+    durations: DDSketch = field(default_factory=DDSketch)
+
+    def merge(self, other: "RequestStats") -> "RequestStats":
+        self.requests += other.requests
+        self.bytes_sent += other.bytes_sent
+        self.durations.merge(other.durations)
+        return self
+
+
+class PerformanceCounter(MergeableCounter):
+    """
+    A counter class which tracks the number of requests, bytes sent and request durations per domain per hour.
+
+    Durations are kept in a DDSketch, so percentiles are accurate to within 1% using bounded memory regardless of
+    how busy the domain is. All requests are counted, regardless of their method or status.
+    """
+
+    name = "performance"
+    filters = []
+    quantiles = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+    def __init__(self):
+        super().__init__()
+        self.data: dict[tuple[str, datetime], RequestStats] = {}
+
+    def add_entry(self, record: LogRecord):
+        x = record.request_time
+        key = (record.domain, datetime(x.year, x.month, x.day, x.hour))
+        stats = self.data.get(key)
+        if stats is None:
+            stats = self.data[key] = RequestStats()
+        stats.requests += 1
+        stats.bytes_sent += record.bytes_sent or 0
+        if record.request_duration is not None:
+            stats.durations.add(record.request_duration)
+
+    @property
+    def views(self) -> int:
+        return sum(stats.requests for stats in self.data.values())
+
+    def report(self) -> "pd.DataFrame":
+        """
+        Generates a report with columns 'domain', 'hour', 'requests', 'bytes_sent' and the p50, p95 and p99 request
+        durations (in microseconds)
+        """
+        import pandas as pd
+
+        duration_columns = [f"duration_{name}_us" for name in self.quantiles]
+        rows = []
+        for (domain, hour), stats in sorted(self.data.items()):
+            row = {
+                "domain": domain,
+                "hour": hour,
+                "requests": stats.requests,
+                "bytes_sent": stats.bytes_sent,
+            }
+            for column, q in zip(duration_columns, self.quantiles.values()):
+                value = stats.durations.quantile(q)
+                row[column] = None if value is None else round(value)
+            rows.append(row)
+        columns = ["domain", "hour", "requests", "bytes_sent"] + duration_columns
+        return pd.DataFrame(rows, columns=columns)
+
+
+class TopKCounter(MergeableCounter):
+    """
+    A counter class which tracks the most requested URIs, and the busiest remote hosts and user agents, per domain
+    per day.
+
+    Each is kept in a Space-Saving sketch of fixed capacity, so memory stays bounded no matter how many distinct
+    (e.g. query string heavy) URIs a domain serves. Reported counts may be over-estimated by at most their error.
+    All requests are counted, regardless of their method or status.
+    """
+
+    name = "top-k"
+    filters = []
+    dimensions = ["uri", "remote_host", "user_agent"]
+    capacity = 1000
+    top = 25
+
+    def __init__(self):
+        super().__init__()
+        self.data: dict[tuple[str, date, str], SpaceSaving] = {}
+
+    def add_entry(self, record: LogRecord):
+        day = record.request_time.date()
+        for dimension in self.dimensions:
+            try:
+                value = getattr(record, dimension)
+            except ValueError:
+                # the request line couldn't be split into a method, uri and protocol
+                continue
+            key = (record.domain, day, dimension)
+            sketch = self.data.get(key)
+            if sketch is None:
+                sketch = self.data[key] = SpaceSaving(self.capacity)
+            sketch.add("-" if value is None else str(value))
+
+    @property
+    def views(self) -> int:
+        # every request is added once to the remote host sketch of its day
+        return sum(
+            sketch.total
+            for (_, _, dimension), sketch in self.data.items()
+            if dimension == "remote_host"
+        )
+
+    def report(self) -> "pd.DataFrame":
+        """Generates a report with columns 'domain', 'date', 'dimension', 'rank', 'value', 'count', 'error'"""
+        import pandas as pd
+
+        rows = []
+        for (domain, day, dimension), sketch in sorted(self.data.items()):
+            for rank, (value, count, error) in enumerate(sketch.top(self.top), 1):
+                rows.append(
+                    {
+                        "domain": domain,
+                        "date": day,
+                        "dimension": dimension,
+                        "rank": rank,
+                        "value": value,
+                        "count": count,
+                        "error": error,
+                    }
+                )
+        columns = ["domain", "date", "dimension", "rank", "value", "count", "error"]
+        return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,232 @@
+"""This module manages the SQLite database used to store counter results across domains"""
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import (
+    Column,
+    Date,
+    Engine,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    event,
+    select,
+)
+from sqlalchemy.dialects.sqlite import insert
+
+from src.sketches import HyperLogLog
+
+# sentinel stored in the `hour` column for rows that cover an entire day
+ALL_DAY = -1
+
+metadata = MetaData()
+
+counts = Table(
+    "counts",
+    metadata,
+    Column("domain", String, primary_key=True),
+    Column("counter", String, primary_key=True),
+    Column("date", Date, primary_key=True),
+    Column("hour", Integer, primary_key=True, default=ALL_DAY),
+    Column("visits", Integer, nullable=False),
+    Column("views", Integer, nullable=False),
+    Index("ix_counts_domain_date", "domain", "date"),
+    Index("ix_counts_counter_date", "counter", "date"),
+)
+
+rollups = Table(
+    "rollups",
+    metadata,
+    Column("domain", String, primary_key=True),
+    Column("counter", String, primary_key=True),
+    Column("date", Date, primary_key=True),
+    Column("hour", Integer, primary_key=True, default=ALL_DAY),
+    Column("views", Integer, nullable=False),
+    Column("visitors", Integer, nullable=False),
+    # sum of the distinct visitors of each hour, i.e. visits counted per hour
+    Column("hourly_visitors", Integer, nullable=False),
+    Column("sketch", LargeBinary, nullable=False),
+    Index("ix_rollups_domain_date", "domain", "date"),
+    Index("ix_rollups_counter_date", "counter", "date"),
+)
+
+GRANULARITIES = ["hour", "day", "week", "month"]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def get_engine(db_path: Union[str, Path]) -> Engine:
+    """Creates an engine for the SQLite database at `db_path`, creating the file and its tables if needed"""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f"sqlite:///{db_path}")
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    metadata.create_all(engine)
+    return engine
+
+
+def upsert_counts(engine: Engine, rows: Iterable[dict]) -> int:
+    """
+    Bulk inserts the given rows into the counts table within a single transaction.
+
+    Rows that already exist for the same domain, counter, date and hour are overwritten, so reprocessing a day
+    replaces its previous results rather than duplicating them.
+    """
+    rows = [{"hour": ALL_DAY, **row} for row in rows]
+    if not rows:
+        return 0
+    stmt = insert(counts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.name for c in counts.primary_key],
+        set_={"visits": stmt.excluded.visits, "views": stmt.excluded.views},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+    return len(rows)
+
+
+def upsert_rollups(engine: Engine, counter: str, rows: Iterable[dict]) -> int:
+    """
+    Bulk inserts the given rollup rows for a counter within a single transaction, overwriting existing rows.
+
+    Rows whose `hour` is None are stored as the rollup for the whole day.
+    """
+    rows = [
+        {
+            **row,
+            "counter": counter,
+            "hour": ALL_DAY if row["hour"] is None else row["hour"],
+        }
+        for row in rows
+    ]
+    if not rows:
+        return 0
+    stmt = insert(rollups)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.name for c in rollups.primary_key],
+        set_={
+            name: stmt.excluded[name]
+            for name in ("views", "visitors", "hourly_visitors", "sketch")
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+    return len(rows)
+
+
+def _period_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def rollup_report(
+    engine: Engine,
+    counter: str,
+    granularity: str = "day",
+    domains: Optional[Iterable[str]] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> list[dict]:
+    """
+    Derives views and visitors per domain for each hour, day, week or month from the stored rollups.
+
+    Week and month rows are built by merging the stored daily sketches, so `visitors` is the estimated number of
+    distinct visitors across the whole period, while `hourly_visitors` sums the distinct visitors of each hour.
+    Weeks start on Monday; `start` is inclusive and `end` is exclusive.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    stmt = select(rollups).where(rollups.c.counter == counter)
+    if granularity == "hour":
+        stmt = stmt.where(rollups.c.hour != ALL_DAY)
+    else:
+        stmt = stmt.where(rollups.c.hour == ALL_DAY)
+    if domains:
+        stmt = stmt.where(rollups.c.domain.in_(list(domains)))
+    if start:
+        stmt = stmt.where(rollups.c.date >= start)
+    if end:
+        stmt = stmt.where(rollups.c.date < end)
+    stmt = stmt.order_by(rollups.c.domain, rollups.c.date, rollups.c.hour)
+
+    with engine.connect() as conn:
+        result = conn.execute(stmt).mappings()
+        if granularity in ("hour", "day"):
+            return [
+                {
+                    "domain": row["domain"],
+                    "date": row["date"],
+                    "hour": None if row["hour"] == ALL_DAY else row["hour"],
+                    "views": row["views"],
+                    "visitors": row["visitors"],
+                    "hourly_visitors": row["hourly_visitors"],
+                }
+                for row in result
+            ]
+        periods: dict[tuple[str, date], dict] = {}
+        for row in result:
+            key = (row["domain"], _period_start(row["date"], granularity))
+            sketch = HyperLogLog.from_bytes(row["sketch"])
+            period = periods.get(key)
+            if period is None:
+                periods[key] = {
+                    "views": row["views"],
+                    "hourly_visitors": row["hourly_visitors"],
+                    "sketch": sketch,
+                }
+            else:
+                period["views"] += row["views"]
+                period["hourly_visitors"] += row["hourly_visitors"]
+                period["sketch"].merge(sketch)
+    return [
+        {
+            "domain": domain,
+            "date": period_start,
+            "hour": None,
+            "views": period["views"],
+            "visitors": period["sketch"].count(),
+            "hourly_visitors": period["hourly_visitors"],
+        }
+        for (domain, period_start), period in periods.items()
+    ]
+
+
+def query_counts(
+    engine: Engine,
+    domains: Optional[Iterable[str]] = None,
+    counter: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> list[dict]:
+    """
+    Returns the stored counts matching the given filters, where `start` is inclusive and `end` is exclusive.
+
+    Counts covering a whole day have an hour of None.
+    """
+    stmt = select(counts).order_by(counts.c.domain, counts.c.date, counts.c.hour)
+    if domains:
+        stmt = stmt.where(counts.c.domain.in_(list(domains)))
+    if counter:
+        stmt = stmt.where(counts.c.counter == counter)
+    if start:
+        stmt = stmt.where(counts.c.date >= start)
+    if end:
+        stmt = stmt.where(counts.c.date < end)
+    with engine.connect() as conn:
+        return [
+            {**row, "hour": None if row["hour"] == ALL_DAY else row["hour"]}
+            for row in conn.execute(stmt).mappings()
+        ]
@@ -1,11 +1,14 @@
 from datetime import datetime
-from typing import Protocol
+from typing import TYPE_CHECKING, Protocol
 from urllib.parse import urlparse
 
 from apachelogs import LogEntry
 
 from .utils import split_request_line
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 DEFAULT_FILTERED_EXTENSIONS = [
     ".css",
     ".ico",
@@ -29,18 +32,44 @@ class Filter(Protocol):
     def filter(self, entry: LogEntry) -> bool:
         ...
 
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        """Vectorized equivalent of `filter` over a batch of parsed lines (see src.batch)"""
+        ...
+
+
+def unique_mask(values: "pd.Series", predicate) -> "pd.Series":
+    """Evaluates the predicate once per distinct value of the series, treating missing values as False"""
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(values)
+    keep = np.array([bool(predicate(value)) for value in uniques] + [False])
+    return pd.Series(keep[codes], index=values.index)
+
 
 class StatusFilter:
     def __init__(self, redirects_ok: bool = True):
         self.redirects_ok = redirects_ok
 
     def filter(self, entry: LogEntry) -> bool:
+        if entry.status is None:
+            # the status was logged as "-"
+            return False
         if self.redirects_ok and entry.status in (303, 304, 305):
             return True
         if 200 <= entry.status < 300:
             return True
         return False
 
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        import pandas as pd
+
+        status = pd.to_numeric(batch["status"])
+        mask = (200 <= status) & (status < 300)
+        if self.redirects_ok:
+            mask |= status.isin([303, 304, 305])
+        return mask
+
 
 class RequestTimeFilter:
     def __init__(self, start: datetime, end: datetime):
@@ -53,6 +82,9 @@ class RequestTimeFilter:
             return True
         return False
 
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        return unique_mask(batch["request_time"], lambda x: self.start <= x < self.end)
+
 
 class MethodFilter:
     def __init__(self, methods: list[str]):
@@ -69,6 +101,11 @@ class MethodFilter:
                 return True
         return False
 
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        return unique_mask(
+            batch["method"], lambda method: method.upper() in self.methods
+        )
+
 
 class UriFilter:
     def __init__(self, exclusions: list[str]):
@@ -80,12 +117,21 @@ class UriFilter:
             _, uri, _ = split_request_line(entry.request_line)
         except ValueError:
             return False
-        parsed = urlparse(uri)
+        try:
+            parsed = urlparse(uri)
+        except ValueError:
+            return False
         for exclusion in self.exclusions:
             if exclusion in parsed.path:
                 return False
         return True
 
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        return unique_mask(
+            batch["path"],
+            lambda path: not any(exclusion in path for exclusion in self.exclusions),
+        )
+
 
 class UriExtensionFilter:
     def __init__(self, filtered_extensions: list[str] = None):
@@ -97,8 +143,17 @@ class UriExtensionFilter:
             _, uri, _ = split_request_line(entry.request_line)
         except ValueError:
             return False
-        parsed = urlparse(uri)
+        try:
+            parsed = urlparse(uri)
+        except ValueError:
+            return False
         for extension in self.filtered_extensions:
             if parsed.path.endswith(extension):
                 return False
         return True
+
+    def mask(self, batch: "pd.DataFrame") -> "pd.Series":
+        return unique_mask(
+            batch["path"],
+            lambda path: not path.endswith(tuple(self.filtered_extensions)),
+        )
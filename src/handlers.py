@@ -3,6 +3,8 @@ from typing import Protocol, Union
 
 import pandas as pd
 
+from src import database
+
 
 class OutputHandler(Protocol):
     def handle_output(self, output: pd.DataFrame) -> None:
@@ -28,3 +30,25 @@ class StdOutHandler:
         print("Ouput DataFrame (head):")
         print(output.head())
         print(f"N rows: {len(output)}")
+
+
+class SQLiteHandler:
+    def __init__(self, filepath: Union[str, Path], counter: str):
+        """Handler that upserts report rows for the given counter into a SQLite database"""
+        self.filepath = Path(filepath)
+        self.counter = counter
+        self.engine = database.get_engine(self.filepath)
+
+    def handle_output(self, output: pd.DataFrame):
+        """Writes the given output to the counts table, replacing any existing rows for the same periods"""
+        columns = [
+            c for c in ("domain", "date", "hour", "visits", "views") if c in output
+        ]
+        df = output[columns].copy()
+        df["date"] = pd.to_datetime(df["date"].astype(str)).dt.date
+        df["visits"] = df["visits"].astype(int)
+        df["views"] = df["views"].astype(int)
+        rows = [
+            {"counter": self.counter, **row} for row in df.to_dict(orient="records")
+        ]
+        database.upsert_counts(self.engine, rows)
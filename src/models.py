@@ -62,6 +62,15 @@ class LogRecord:
     def remote_host(self) -> str:
         return self.entry.remote_host
 
+    @property
+    def request_duration(self) -> Optional[int]:
+        """The time taken to serve the request, in microseconds"""
+        return self.entry.request_duration_microseconds
+
+    @property
+    def bytes_sent(self) -> Optional[int]:
+        return self.entry.bytes_sent
+
     @property
     def valid(self) -> bool:
         validators = [
@@ -0,0 +1,57 @@
+"""This module combines the counters produced for each of a domain's log files into one report per counter"""
+from typing import TYPE_CHECKING, Iterator
+
+from src import sampling
+from src.counters import AbstractCounter
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class ReportCollector:
+    """
+    Collects the counters returned for each log file of a domain, in the order of the counter classes they were
+    created from.
+
+    Counters which are `mergeable` are merged together and reported once, while the reports of all other counters are
+    summed by domain and date (and scaled up, if they were sampled).
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+        self.counters: dict[int, AbstractCounter] = {}
+        self.reports: dict[int, list["pd.DataFrame"]] = {}
+        self.visitor_totals: dict[int, list["pd.DataFrame"]] = {}
+
+    def add(self, counters: list[AbstractCounter]):
+        for i, counter in enumerate(counters):
+            if counter.mergeable:
+                if i in self.counters:
+                    self.counters[i].merge(counter)
+                else:
+                    self.counters[i] = counter
+                continue
+            self.counters[i] = counter
+            self.reports.setdefault(i, []).append(counter.report())
+            if self.sample_rate < 1:
+                self.visitor_totals.setdefault(i, []).append(
+                    sampling.visitor_totals(counter)
+                )
+
+    def results(self) -> Iterator[tuple[AbstractCounter, "pd.DataFrame"]]:
+        """Yields each counter (merged, if mergeable) along with its combined report"""
+        import pandas as pd
+
+        for i, counter in sorted(self.counters.items()):
+            if counter.mergeable:
+                yield counter, counter.report()
+                continue
+            df = pd.concat(self.reports[i])
+            df = df.groupby(["domain", "date"]).sum(numeric_only=False).reset_index()
+            if self.sample_rate < 1:
+                # visitors are only combined across files here, before their totals are squared
+                variance = sampling.estimate_variance(
+                    pd.concat(self.visitor_totals[i]), self.sample_rate
+                )
+                df = sampling.scale_report(df, variance, self.sample_rate)
+            yield counter, df
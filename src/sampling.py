@@ -0,0 +1,112 @@
+"""This module implements deterministic visitor sampling, for estimating counts from a fraction of the logs"""
+import math
+import re
+from typing import TYPE_CHECKING
+
+from config import Config
+
+from src.counters import AbstractCounter
+from src.sketches import hash64
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# z-score for a 95% confidence interval
+Z_95 = 1.96
+
+# the remote host must be the first field, and the user agent the last quoted field
+VISITOR_FORMAT_RE = re.compile(r'^%h .*"%\{User-agent\}i"[^"]*$', re.IGNORECASE)
+
+
+class VisitorSampler:
+    """
+    Selects a fraction of raw log lines by hashing their remote host + user agent, before the lines are parsed.
+
+    The same visitor always hashes to the same value, so a sampled visitor keeps all of their views and the selection
+    is identical across files, processes and runs.
+    """
+
+    def __init__(self, rate: float, log_format: str = Config.LOG_FORMAT):
+        if not 0 < rate <= 1:
+            raise ValueError(f"Sample rate must be in (0, 1], not {rate}")
+        if not VISITOR_FORMAT_RE.match(log_format):
+            raise ValueError(
+                "Sampling needs a log format starting with %h and whose last quoted field is "
+                f'"%{{User-agent}}i", not {log_format!r}'
+            )
+        self.rate = rate
+        self.threshold = math.floor(rate * 2**64)
+
+    @staticmethod
+    def visitor_key(line: str) -> str:
+        """Extracts the remote host (the first field) and user agent (the last quoted field) from a raw log line"""
+        host, _, rest = line.partition(" ")
+        parts = rest.rsplit('"', 2)
+        user_agent = parts[-2] if len(parts) == 3 else ""
+        return f"{host} {user_agent}"
+
+    def __call__(self, line: str) -> bool:
+        return hash64(self.visitor_key(line)) < self.threshold
+
+
+VISITOR_KEYS = ["domain", "date", "remote_host", "user_agent"]
+
+
+def visitor_totals(counter: AbstractCounter) -> "pd.DataFrame":
+    """Totals the visits and views of each sampled visitor per domain and date in a (single file's) counter"""
+    import pandas as pd
+
+    df = counter.to_df()
+    if len(df) == 0:
+        return pd.DataFrame(columns=VISITOR_KEYS + ["visits", "views"])
+    df["date"] = pd.to_datetime(df.request_time).dt.date.astype(str)
+    return (
+        df.groupby(VISITOR_KEYS, dropna=False)
+        .agg(visits=("views", "count"), views=("views", "sum"))
+        .reset_index()
+    )
+
+
+def estimate_variance(totals: "pd.DataFrame", rate: float) -> "pd.DataFrame":
+    """
+    Estimates the variance of the scaled up visits and views per domain and date from sampled visitor totals.
+
+    Visitors are sampled independently with probability `rate`, so the variance of each total is estimated as
+    (1 - rate) / rate^2 times the sum of each sampled visitor's squared visits (or views) that day. A visitor's day
+    may span several log files, so `totals` should hold the visitor totals of all of a domain's files: they are
+    combined per visitor before being squared.
+    """
+    import pandas as pd
+
+    columns = ["domain", "date", "visits_var", "views_var"]
+    if len(totals) == 0:
+        return pd.DataFrame(columns=columns)
+    per_visitor = (
+        totals.groupby(VISITOR_KEYS, dropna=False)[["visits", "views"]]
+        .sum()
+        .astype(float)
+    )
+    factor = (1 - rate) / rate**2
+    variance = (per_visitor**2 * factor).groupby(["domain", "date"]).sum()
+    variance.columns = ["visits_var", "views_var"]
+    return variance.reset_index()[columns]
+
+
+def scale_report(
+    report: "pd.DataFrame", variance: "pd.DataFrame", rate: float
+) -> "pd.DataFrame":
+    """Scales up the visits and views of a sampled report, adding 95% confidence intervals for each"""
+    variance = variance.groupby(["domain", "date"]).sum().reset_index()
+    df = report.assign(_date=report.date.astype(str)).merge(
+        variance.rename(columns={"date": "_date"}),
+        on=["domain", "_date"],
+        how="left",
+    )
+    for column in ("visits", "views"):
+        estimate = df[column] / rate
+        margin = Z_95 * df[f"{column}_var"].fillna(0) ** 0.5
+        df[column] = estimate.round().astype(int)
+        df[f"{column}_ci_low"] = (estimate - margin).clip(lower=0).round().astype(int)
+        df[f"{column}_ci_high"] = (estimate + margin).round().astype(int)
+    df["sample_rate"] = rate
+    return df.drop(columns=["_date", "visits_var", "views_var"])
@@ -1,12 +1,13 @@
 import gzip
 from pathlib import Path
-from typing import Iterable, Union
+from typing import Callable, Iterable, Optional, Union
 
 from apachelogs import InvalidEntryError, LogParser
 
 from config import Config
 from src.counters import AbstractCounter
 from src.models import LogRecord
+from src.sampling import VisitorSampler
 
 
 def read_logfile(logfile: Path) -> Iterable[str]:
@@ -21,10 +22,18 @@ def read_logfile(logfile: Path) -> Iterable[str]:
                 yield line
 
 
-def count_log_entries(logfile: Union[str, Path], counters: list[AbstractCounter]):
+def count_log_entries(
+    logfile: Union[str, Path],
+    counters: list[AbstractCounter],
+    log_format: str = Config.LOG_FORMAT,
+    sampler: Optional[Callable[[str], bool]] = None,
+):
+    """Parses each line of the logfile and passes it to the counters. Lines rejected by the sampler are not parsed."""
     logfile = Path(logfile)
-    parser = LogParser(Config.LOG_FORMAT)
+    parser = LogParser(log_format)
     for i, line in enumerate(read_logfile(logfile)):
+        if sampler is not None and not sampler(line):
+            continue
         try:
             entry = parser.parse(line)
         except (InvalidEntryError, ValueError):
@@ -36,18 +45,22 @@ def count_log_entries(logfile: Union[str, Path], counters: list[AbstractCounter]
 
 
 def threaded_count_log_entries(
-    logfile: Union[str, Path], log_format: str, counter_class: AbstractCounter
-) -> AbstractCounter:
-    """A thread safe implementation of count_log_entries. This will initialize a new counter object, read the logfile, and return the counter for further processing."""
-    logfile = Path(logfile)
-    parser = LogParser(log_format)
-    counter = counter_class()
-    for i, line in enumerate(read_logfile(logfile)):
-        try:
-            entry = parser.parse(line)
-        except (InvalidEntryError, ValueError):
-            continue
-        else:
-            record = LogRecord(logfile.name, i + 1, entry)
-            counter.handle(record)
-    return counter
+    logfile: Union[str, Path],
+    log_format: str,
+    counter_classes: list[Callable[[], AbstractCounter]],
+    sample_rate: float = 1.0,
+    engine: str = "record",
+) -> list[AbstractCounter]:
+    """A thread safe implementation of count_log_entries. This will initialize a new object for each counter class, read the logfile once, and return the counters for further processing.
+
+    The "batch" engine counts the logfile in vectorized chunks instead of one record at a time (see src.batch)."""
+    counters = [counter_class() for counter_class in counter_classes]
+    sampler = VisitorSampler(sample_rate, log_format) if sample_rate < 1 else None
+    if engine == "batch":
+        # imported here as the batch engine depends on pandas, which the record engine doesn't need
+        from src.batch import batch_count_log_entries
+
+        batch_count_log_entries(logfile, counters, log_format, sampler)
+    else:
+        count_log_entries(logfile, counters, log_format, sampler)
+    return counters
@@ -0,0 +1,218 @@
+"""This module is a collection of mergeable, fixed-size data sketches used to summarize traffic"""
+import hashlib
+import heapq
+import math
+import zlib
+from typing import Optional
+
+
+def hash64(value: str) -> int:
+    """Returns a stable 64-bit hash of the given value (unlike `hash`, this is consistent across processes)"""
+    return int.from_bytes(
+        hashlib.blake2b(
+            value.encode("utf-8", "surrogateescape"), digest_size=8
+        ).digest(),
+        "big",
+    )
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values added to it using a fixed 2^precision bytes of memory.
+
+    Sketches built with the same precision can be merged, with the merged sketch estimating the number of distinct
+    values across all of them. The standard error of the estimate is roughly 1.04 / sqrt(2^precision).
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"precision must be between 4 and 16, not {precision}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        h = hash64(value)
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Folds another sketch into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[0])
+        sketch.registers = bytearray(zlib.decompress(data[1:]))
+        return sketch
+
+
+class DDSketch:
+    """
+    Estimates quantiles of positive values to within a relative accuracy, using at most `max_bins` counters.
+
+    Values are counted in logarithmically sized bins, so any quantile returned is within `relative_accuracy` of the
+    true value. Sketches with the same relative accuracy can be merged. Should the number of bins exceed `max_bins`,
+    the lowest bins are collapsed together, trading accuracy on the lowest quantiles for bounded memory.
+    """
+
+    __slots__ = ("relative_accuracy", "max_bins", "gamma", "bins", "zeros", "count")
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                f"relative_accuracy must be between 0 and 1, not {relative_accuracy}"
+            )
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.bins: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value, self.gamma))
+        self.bins[key] = self.bins.get(key, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        collapsed = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += collapsed
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        """Folds another sketch into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracies")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns an estimate of the q-th quantile (0 <= q <= 1), or None if the sketch is empty"""
+        if not 0 <= q <= 1:
+            raise ValueError(f"q must be between 0 and 1, not {q}")
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class SpaceSaving:
+    """
+    Tracks the most frequent values in a stream (the heavy hitters) using at most `capacity` counters.
+
+    Once the sketch is full, a new value replaces the value with the lowest count, inheriting that count as its error.
+    Counts are therefore never underestimated, and over-estimated by at most their `error`. Any value occurring more
+    than total / capacity times is guaranteed to be tracked. Sketches can be merged.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "total", "_heap")
+
+    def __init__(self, capacity: int = 1000):
+        if capacity < 1:
+            raise ValueError(f"capacity must be positive, not {capacity}")
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        # the exact number of values added, including those no longer tracked
+        self.total = 0
+        # min-heap of (count, value) which may hold stale entries, rebuilt whenever it grows too large
+        self._heap: list[tuple[int, str]] = []
+
+    def _rebuild_heap(self):
+        self._heap = [(count, value) for value, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> tuple[int, str]:
+        while True:
+            count, value = heapq.heappop(self._heap)
+            if self.counts.get(value) == count:
+                return count, value
+
+    def add(self, value: str, count: int = 1) -> None:
+        self.total += count
+        if value in self.counts:
+            self.counts[value] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = count
+            self.errors[value] = 0
+        else:
+            min_count, min_value = self._pop_min()
+            del self.counts[min_value]
+            del self.errors[min_value]
+            self.counts[value] = min_count + count
+            self.errors[value] = min_count
+        heapq.heappush(self._heap, (self.counts[value], value))
+        if len(self._heap) > 2 * self.capacity:
+            self._rebuild_heap()
+
+    @property
+    def min_count(self) -> int:
+        """The count any untracked value may have occurred up to"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """Folds another sketch into this one, keeping the `capacity` values with the highest combined counts"""
+        self_min, other_min = self.min_count, other.min_count
+        counts, errors = {}, {}
+        for value in self.counts.keys() | other.counts.keys():
+            counts[value] = self.counts.get(value, self_min) + other.counts.get(
+                value, other_min
+            )
+            errors[value] = self.errors.get(value, self_min) + other.errors.get(
+                value, other_min
+            )
+        top = heapq.nlargest(self.capacity, counts, key=counts.get)
+        self.total += other.total
+        self.counts = {value: counts[value] for value in top}
+        self.errors = {value: errors[value] for value in top}
+        self._rebuild_heap()
+        return self
+
+    def top(self, k: int) -> list[tuple[str, int, int]]:
+        """Returns up to k (value, count, error) tuples, in descending order of count"""
+        values = heapq.nlargest(k, self.counts, key=self.counts.get)
+        return [(value, self.counts[value], self.errors[value]) for value in values]
@@ -0,0 +1,207 @@
+"""This module follows actively written log files, feeding new lines through the counters as they arrive"""
+import gzip
+import os
+import pickle
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterator, Optional, Union
+
+from apachelogs import InvalidEntryError, LogParser
+
+from config import Config
+from src.counters import AbstractCounter
+from src.models import LogRecord
+from src.utils import FILE_RE, date_from_filename
+
+if TYPE_CHECKING:
+    from src.handlers import OutputHandler
+
+CHUNK_SIZE = 1 << 20
+
+
+def current_logfile(domain: Path) -> Optional[Path]:
+    """Returns the uncompressed log file with the latest date in the domain's folder, if there is one"""
+    candidates = [
+        file
+        for file in domain.iterdir()
+        if file.is_file() and file.suffix != ".gz" and FILE_RE.match(file.name)
+    ]
+    return max(candidates, key=date_from_filename, default=None)
+
+
+class LogFollower:
+    """
+    Follows the log file currently being written for a domain, keeping track of how far into it has been read.
+
+    Only complete lines are returned. Once a newer log file appears (or the followed file is removed or replaced),
+    the remainder of the followed file is read, from its rotated `.gz` copy if need be, before moving on.
+    """
+
+    def __init__(
+        self,
+        domain: Union[str, Path],
+        path: Optional[Path] = None,
+        offset: int = 0,
+        inode: Optional[int] = None,
+    ):
+        self.domain = Path(domain)
+        self.path = path
+        self.offset = offset
+        self.inode = inode
+
+    def _read(self, file: BinaryIO, final: bool) -> Iterator[str]:
+        file.seek(self.offset)
+        remainder = b""
+        while chunk := file.read(CHUNK_SIZE):
+            lines = (remainder + chunk).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                self.offset += len(line) + 1
+                yield line.decode("utf-8", errors="replace")
+        if final and remainder:
+            self.offset += len(remainder)
+            yield remainder.decode("utf-8", errors="replace")
+
+    def _is_followed_file(self) -> bool:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        if self.inode is not None and stat.st_ino != self.inode:
+            return False
+        return stat.st_size >= self.offset
+
+    def _drain(self) -> Iterator[str]:
+        """Reads the rest of a file which is no longer being written to"""
+        if self._is_followed_file():
+            with self.path.open("rb") as file:
+                yield from self._read(file, final=True)
+            return
+        rotated = self.path.with_name(f"{self.path.name}.gz")
+        if rotated.exists():
+            with gzip.open(rotated, "rb") as file:
+                yield from self._read(file, final=True)
+        else:
+            print(f"Unable to find the rest of {self.path.name}; skipping it")
+
+    def read_lines(self) -> Iterator[str]:
+        """Yields any complete lines written since the last read"""
+        while True:
+            latest = current_logfile(self.domain)
+            if self.path is None:
+                if latest is None:
+                    return
+                self.path, self.offset, self.inode = latest, 0, None
+            if self.path == latest and self._is_followed_file():
+                with self.path.open("rb") as file:
+                    self.inode = os.fstat(file.fileno()).st_ino
+                    yield from self._read(file, final=False)
+                return
+            # the followed file has been rotated, so finish it off before moving to the latest file
+            yield from self._drain()
+            self.path, self.offset, self.inode = None, 0, None
+
+
+class LogWatcher:
+    """
+    Incrementally counts the lines of a domain's live log, periodically flushing the counter's report to a handler.
+
+    The read position and counter data are saved to `state_file` on every flush, so a restarted watcher resumes
+    where the last flush left off. Data for days before yesterday is evicted on flush to keep memory bounded, so
+    the handler should upsert rows (e.g. SQLiteHandler) rather than overwrite the whole output.
+    """
+
+    def __init__(
+        self,
+        domain: Union[str, Path],
+        counter_class: type[AbstractCounter],
+        handler: "OutputHandler",
+        state_file: Union[str, Path],
+        log_format: str = Config.LOG_FORMAT,
+    ):
+        self.handler = handler
+        self.state_file = Path(state_file)
+        self.parser = LogParser(log_format)
+        self.counter = counter_class()
+        self.follower = LogFollower(domain)
+        self.row = 0
+        self.latest: Optional[date] = None
+        self.load_state()
+
+    def load_state(self):
+        if not self.state_file.exists():
+            return
+        with self.state_file.open("rb") as f:
+            state = pickle.load(f)
+        self.follower.path = state["path"]
+        self.follower.offset = state["offset"]
+        self.follower.inode = state["inode"]
+        self.row = state["row"]
+        self.latest = state["latest"]
+        self.counter.data = state["data"]
+
+    def save_state(self):
+        state = {
+            "path": self.follower.path,
+            "offset": self.follower.offset,
+            "inode": self.follower.inode,
+            "row": self.row,
+            "latest": self.latest,
+            "data": self.counter.data,
+        }
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_name(f"{self.state_file.name}.tmp")
+        with tmp_file.open("wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def step(self) -> int:
+        """Counts any new lines in the domain's log, returning the number of lines read"""
+        n_lines = 0
+        path = self.follower.path
+        for line in self.follower.read_lines():
+            if self.follower.path != path:
+                path = self.follower.path
+                self.row = 0
+            self.row += 1
+            n_lines += 1
+            try:
+                entry = self.parser.parse(line)
+            except (InvalidEntryError, ValueError):
+                continue
+            record = LogRecord(path.name, self.row, entry)
+            self.counter.handle(record)
+            request_date = entry.request_time.date()
+            if self.latest is None or request_date > self.latest:
+                self.latest = request_date
+        return n_lines
+
+    def flush(self):
+        """Writes the counter's report to the handler and saves the watcher's state"""
+        if len(self.counter.data) > 0:
+            self.handler.handle_output(self.counter.report())
+        if self.latest is not None:
+            self.counter.evict_before(self.latest - timedelta(days=1))
+        self.save_state()
+
+
+def watch(
+    watchers: list[LogWatcher],
+    flush_interval: float = 60,
+    poll_interval: float = 1,
+):
+    """Polls each watcher for new lines until interrupted, flushing them every `flush_interval` seconds"""
+    last_flush = time.monotonic()
+    try:
+        while True:
+            n_lines = sum(watcher.step() for watcher in watchers)
+            if time.monotonic() - last_flush >= flush_interval:
+                for watcher in watchers:
+                    watcher.flush()
+                last_flush = time.monotonic()
+            if n_lines == 0:
+                time.sleep(poll_interval)
+    finally:
+        for watcher in watchers:
+            watcher.flush()
@@ -1,11 +1,12 @@
 import functools
 import re
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
 from typing import Union
 
 DOMAIN_RE = re.compile(r"^(?P<domain>.+?)(?:[:\-/]443)?\.\d{6}(?:\.gz)?$")
 FILE_RE = re.compile("^.*?\.\d{6}(\.gz)?$")
+DATE_RE = re.compile(r"\.(?P<month>\d{2})(?P<day>\d{2})(?P<year>\d{2})(?:\.gz)?$")
 
 
 def timeit(f):
@@ -41,6 +42,18 @@ def domain_from_filename(file: Union[str, Path]) -> str:
     return matched.group("domain")
 
 
+def date_from_filename(file: Union[str, Path]) -> date:
+    file = Path(file)
+    matched = DATE_RE.search(file.name)
+    if matched is None:
+        raise ValueError(f"Could not parse date: {file.name}")
+    return date(
+        2000 + int(matched.group("year")),
+        int(matched.group("month")),
+        int(matched.group("day")),
+    )
+
+
 def gather_domains(domains: tuple[str], source_dir: Union[Path, str]) -> list[Path]:
     source_dir = Path(source_dir)
     if domains[0] == "all":
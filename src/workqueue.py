@@ -0,0 +1,327 @@
+"""
+This module implements a work queue on a shared filesystem, so that the log files of an analysis can be spread across
+any number of worker processes on any number of nodes which mount the same storage.
+
+A queue is a directory holding a manifest of jobs (one per log file) and, for each job, a lock file while a worker has
+claimed it and a partial result once it is done. Claims are made by atomically creating the lock file; workers keep
+their lock's modification time fresh while they work, so a lock which hasn't been touched within the lease is
+assumed to belong to a dead worker and may be taken over. A lock's age is measured against the shared filesystem's
+own clock (the modification time of a freshly created probe file), so clock skew between nodes doesn't shorten or
+lengthen the lease. Partial results are written atomically and are
+deterministic, so if a slow (rather than dead) worker's job is taken over, finishing it twice is harmless.
+"""
+import json
+import os
+import pickle
+import random
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+
+from src.counters import AbstractCounter
+from src.services import threaded_count_log_entries
+
+
+@dataclass
+class Job:
+    id: str
+    domain: str
+    file: str
+
+
+class WorkQueue:
+    def __init__(self, path: Union[str, Path], lease_seconds: float = 300):
+        self.path = Path(path)
+        self.jobs_dir = self.path / "jobs"
+        self.lease_seconds = lease_seconds
+        self._manifest: Optional[dict] = None
+        self._jobs: Optional[list[Job]] = None
+        # the index of the job each worker tries to claim next
+        self._offsets: dict[str, int] = {}
+
+    @classmethod
+    def create(
+        cls, path: Union[str, Path], files: dict[str, list[Path]], settings: dict
+    ) -> "WorkQueue":
+        """Writes a manifest with a job for each of the given files (keyed by domain) and the analysis settings"""
+        queue = cls(path)
+        if queue.manifest_file.exists():
+            raise FileExistsError(f"A queue already exists at {queue.path}")
+        queue.jobs_dir.mkdir(parents=True, exist_ok=True)
+        jobs = []
+        for domain, domain_files in files.items():
+            for file in domain_files:
+                jobs.append(
+                    {
+                        "id": f"{len(jobs):06d}",
+                        "domain": domain,
+                        "file": str(Path(file).resolve()),
+                    }
+                )
+        manifest = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "settings": settings,
+            "jobs": jobs,
+        }
+        tmp_file = queue.path / "manifest.json.tmp"
+        tmp_file.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_file, queue.manifest_file)
+        return queue
+
+    @property
+    def manifest_file(self) -> Path:
+        return self.path / "manifest.json"
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            self._manifest = json.loads(self.manifest_file.read_text())
+        return self._manifest
+
+    @property
+    def settings(self) -> dict:
+        return self.manifest["settings"]
+
+    @property
+    def jobs(self) -> list[Job]:
+        if self._jobs is None:
+            self._jobs = [Job(**job) for job in self.manifest["jobs"]]
+        return self._jobs
+
+    def _job_files(self) -> set[str]:
+        """Lists the lock, result and error files in the jobs directory with a single directory scan"""
+        with os.scandir(self.jobs_dir) as entries:
+            return {entry.name for entry in entries}
+
+    def _lock_file(self, job: Job) -> Path:
+        return self.jobs_dir / f"{job.id}.lock"
+
+    def _result_file(self, job: Job) -> Path:
+        return self.jobs_dir / f"{job.id}.partial"
+
+    def _error_file(self, job: Job) -> Path:
+        return self.jobs_dir / f"{job.id}.error"
+
+    def is_finished(self, job: Job, job_files: Optional[set[str]] = None) -> bool:
+        if job_files is None:
+            return self._result_file(job).exists() or self._error_file(job).exists()
+        return (
+            self._result_file(job).name in job_files
+            or self._error_file(job).name in job_files
+        )
+
+    def all_finished(self) -> bool:
+        job_files = self._job_files()
+        return all(self.is_finished(job, job_files) for job in self.jobs)
+
+    def _now(self) -> float:
+        """Returns the current time according to the shared filesystem, which sets the mtime of new files"""
+        probe = self.jobs_dir / f".now.{default_worker_id()}"
+        probe.touch()
+        try:
+            return probe.stat().st_mtime
+        finally:
+            probe.unlink(missing_ok=True)
+
+    def _is_stale(self, lock_file: Path, now: Optional[float] = None) -> bool:
+        try:
+            mtime = lock_file.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if now is None:
+            now = self._now()
+        return now - mtime > self.lease_seconds
+
+    def _take_over(self, lock_file: Path, worker_id: str) -> bool:
+        """Moves a stale lock out of the way, returning whether this worker was the one to do so"""
+        expired = lock_file.with_name(f"{lock_file.name}.{worker_id}.expired")
+        try:
+            os.rename(lock_file, expired)
+        except FileNotFoundError:
+            # another worker got there first
+            return False
+        if not self._is_stale(expired):
+            # the lock was renewed (or replaced) between checking and moving it, so try to put it back
+            try:
+                os.link(expired, lock_file)
+            except FileExistsError:
+                pass
+            expired.unlink()
+            return False
+        expired.unlink()
+        return True
+
+    def _lock(self, job: Job, worker_id: str) -> bool:
+        """Atomically creates the job's lock file, returning whether this worker now holds the (unfinished) job"""
+        lock_file = self._lock_file(job)
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{worker_id}\n")
+        if self.is_finished(job):
+            # finished by another worker whilst its lock was being checked
+            lock_file.unlink(missing_ok=True)
+            return False
+        return True
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """
+        Claims the next unfinished job which isn't locked (or whose lock has expired), if there is one.
+
+        A worker first tries the job after the last one it claimed, and only when that isn't free does it scan the
+        jobs directory, starting from a random unfinished job. This keeps workers spread out over the remaining jobs
+        rather than all contending for the same first pending one.
+        """
+        jobs = self.jobs
+        start = self._offsets.get(worker_id)
+        if start is not None and self._lock(jobs[start], worker_id):
+            self._offsets[worker_id] = (start + 1) % len(jobs)
+            return jobs[start]
+        job_files = self._job_files()
+        pending = [
+            i for i, job in enumerate(jobs) if not self.is_finished(job, job_files)
+        ]
+        offset = random.randrange(len(pending)) if pending else 0
+        now = None
+        for i in pending[offset:] + pending[:offset]:
+            job = jobs[i]
+            lock_file = self._lock_file(job)
+            if lock_file.name in job_files:
+                if now is None:
+                    now = self._now()
+                if not self._is_stale(lock_file, now) or not self._take_over(
+                    lock_file, worker_id
+                ):
+                    continue
+                print(f"Lease expired, taking over job {job.id}: {job.file}")
+            if self._lock(job, worker_id):
+                self._offsets[worker_id] = (i + 1) % len(jobs)
+                return job
+        return None
+
+    def _heartbeat(self, job: Job, stop: threading.Event):
+        lock_file = self._lock_file(job)
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                os.utime(lock_file)
+            except FileNotFoundError:
+                return
+
+    def complete(self, job: Job, result: list[AbstractCounter]):
+        """Atomically writes the job's partial result and releases its lock"""
+        result_file = self._result_file(job)
+        tmp_file = result_file.with_name(
+            f"{result_file.name}.{default_worker_id()}.tmp"
+        )
+        with tmp_file.open("wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp_file, result_file)
+        self._lock_file(job).unlink(missing_ok=True)
+
+    def fail(self, job: Job, message: str):
+        """Records that the job raised an exception, so that it isn't retried, and releases its lock"""
+        self._error_file(job).write_text(message)
+        self._lock_file(job).unlink(missing_ok=True)
+
+    def run(
+        self,
+        job: Job,
+        work: Callable[[Job], list[AbstractCounter]],
+    ) -> bool:
+        """Runs the work for a claimed job whilst keeping its lease alive, returning whether it succeeded"""
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            result = work(job)
+        except Exception:
+            self.fail(job, traceback.format_exc())
+            return False
+        finally:
+            stop.set()
+            heartbeat.join()
+        self.complete(job, result)
+        return True
+
+    def status(self) -> dict[str, int]:
+        status = {"pending": 0, "claimed": 0, "done": 0, "failed": 0}
+        job_files = self._job_files()
+        for job in self.jobs:
+            if self._result_file(job).name in job_files:
+                status["done"] += 1
+            elif self._error_file(job).name in job_files:
+                status["failed"] += 1
+            elif self._lock_file(job).name in job_files:
+                status["claimed"] += 1
+            else:
+                status["pending"] += 1
+        return status
+
+    def errors(self) -> Iterator[tuple[Job, str]]:
+        job_files = self._job_files()
+        for job in self.jobs:
+            if self._error_file(job).name in job_files:
+                yield job, self._error_file(job).read_text()
+
+    def results(self, domain: str) -> Iterator[list[AbstractCounter]]:
+        """Yields the partial results of each finished job for the domain"""
+        job_files = self._job_files()
+        for job in self.jobs:
+            result_file = self._result_file(job)
+            if job.domain == domain and result_file.name in job_files:
+                with result_file.open("rb") as f:
+                    yield pickle.load(f)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def run_worker(
+    queue: WorkQueue,
+    counter_classes: list[Callable[[], AbstractCounter]],
+    log_format: str,
+    sample_rate: float = 1.0,
+    engine: str = "record",
+    worker_id: Optional[str] = None,
+    wait: bool = False,
+    poll_interval: float = 5,
+) -> int:
+    """
+    Claims and processes jobs from the queue until none are left, returning the number of jobs processed.
+
+    Without `wait`, the worker stops as soon as there are no jobs left to claim. With it, the worker keeps polling
+    until every job is finished, taking over any whose worker has died.
+    """
+    worker_id = worker_id or default_worker_id()
+
+    def work(job: Job) -> list[AbstractCounter]:
+        return threaded_count_log_entries(
+            logfile=job.file,
+            log_format=log_format,
+            counter_classes=counter_classes,
+            sample_rate=sample_rate,
+            engine=engine,
+        )
+
+    n_jobs = 0
+    while True:
+        job = queue.claim(worker_id)
+        if job is not None:
+            print(f"[{worker_id}] Processing job {job.id}: {Path(job.file).name}")
+            if not queue.run(job, work):
+                print(f"[{worker_id}] Job {job.id} failed: {Path(job.file).name}")
+            n_jobs += 1
+        elif wait and not queue.all_finished():
+            time.sleep(poll_interval)
+        else:
+            return n_jobs
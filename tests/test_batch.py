@@ -0,0 +1,124 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from config import Config
+from src import batch
+from src.batch import BatchParser, batch_count_log_entries, map_unique
+from src.counters import AcquiaCounter, DailyTrafficCounter, PerformanceCounter
+from src.filters import MethodFilter, UriExtensionFilter, UriFilter
+from src.services import threaded_count_log_entries
+
+REQUESTS = [
+    "GET /news HTTP/1.1",
+    "GET /news?page=2 HTTP/1.1",
+    "get /about HTTP/1.1",
+    "POST /contact HTTP/1.1",
+    "GET /styles/site.css HTTP/1.1",
+    "GET /sites/default/files/report.pdf HTTP/1.1",
+    "GET /admin/config HTTP/1.1",
+    "GET http://[bad/ HTTP/1.1",
+    "-",
+]
+STATUSES = [200, 200, 204, 301, 304, 404, 500, "-"]
+AGENTS = ["Mozilla/5.0", "curl/7.79.1", "-", "Googlebot/2.1"]
+
+
+def write_log(path, n_lines: int):
+    with gzip.open(path, "wt") as f:
+        for i in range(n_lines):
+            if i % 97 == 0:
+                f.write("not a log line\n")
+                continue
+            timestamp = f"{1 + i % 3:02d}/Aug/2022:{i % 24:02d}:{i % 60:02d}:00 -0400"
+            if i % 89 == 0:
+                timestamp = f"31/Foo/2022:{i % 24:02d}:00:00 -0400"
+            f.write(
+                f"10.0.{i % 3}.{i % 11} - - [{timestamp}] "
+                f'"{REQUESTS[i % len(REQUESTS)]}" {STATUSES[i % len(STATUSES)]} 512 '
+                f'"-" "{AGENTS[i % len(AGENTS)]}" {1000 + i}\n'
+            )
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    path = tmp_path / "example.080122.gz"
+    write_log(path, 3000)
+    return path
+
+
+def test_batch_engine_matches_record_engine(logfile):
+    counter_classes = [AcquiaCounter, DailyTrafficCounter]
+    expected = threaded_count_log_entries(logfile, Config.LOG_FORMAT, counter_classes)
+    actual = threaded_count_log_entries(
+        logfile, Config.LOG_FORMAT, counter_classes, engine="batch"
+    )
+    for e, a in zip(expected, actual):
+        assert len(e.data) > 0
+        assert a.data == e.data
+        assert a.report().equals(e.report())
+
+
+def test_small_batches_match_record_engine(logfile):
+    expected = AcquiaCounter()
+    actual = AcquiaCounter()
+    threaded = threaded_count_log_entries(logfile, Config.LOG_FORMAT, [AcquiaCounter])
+    expected.merge(threaded[0])
+    batch_count_log_entries(logfile, [actual], batch_size=7)
+    assert actual.data == expected.data
+
+
+def test_sampled_batch_engine_matches_record_engine(logfile):
+    [expected] = threaded_count_log_entries(
+        logfile, Config.LOG_FORMAT, [DailyTrafficCounter], sample_rate=0.5
+    )
+    [actual] = threaded_count_log_entries(
+        logfile,
+        Config.LOG_FORMAT,
+        [DailyTrafficCounter],
+        sample_rate=0.5,
+        engine="batch",
+    )
+    assert actual.data == expected.data
+
+
+def test_mergeable_counters_are_rejected(logfile):
+    with pytest.raises(ValueError):
+        batch_count_log_entries(logfile, [PerformanceCounter()])
+
+
+def test_map_unique():
+    calls = []
+
+    def func(value):
+        calls.append(value)
+        return value.upper()
+
+    result = map_unique(pd.Series(["a", "b", "a", None, "b"]).to_numpy(), func)
+    assert list(result) == ["A", "B", "A", None, "B"]
+    assert calls == ["a", "b"]
+
+
+def test_filter_masks():
+    batch = pd.DataFrame(
+        {
+            "method": ["get", "POST", None, "GET"],
+            "path": ["/news", "/admin/config", None, "/site.css"],
+        },
+        dtype=object,
+    )
+    assert list(MethodFilter(["GET"]).mask(batch)) == [True, False, False, True]
+    assert list(UriFilter(["/admin"]).mask(batch)) == [True, False, False, True]
+    assert list(UriExtensionFilter().mask(batch)) == [True, True, False, False]
+
+
+def test_unsupported_apachelogs_internals_are_rejected(monkeypatch):
+    class ChangedLogParser(batch.LogParser):
+        def __init__(self, log_format):
+            super().__init__(log_format)
+            self._group_defs = [name for name, _, _ in self._group_defs]
+
+    monkeypatch.setattr(batch, "LogParser", ChangedLogParser)
+    with pytest.raises(RuntimeError, match="use the record engine"):
+        BatchParser(Config.LOG_FORMAT)
@@ -0,0 +1,129 @@
+from datetime import date, datetime
+
+import pytest
+
+from src.counters import AcquiaCounter, PerformanceCounter, RollupCounter, TopKCounter
+from src.models import LogRecord
+
+from .fakes import FakeLogEntry
+
+
+def make_record(hour: int, duration: int, bytes_sent=100) -> LogRecord:
+    entry = FakeLogEntry(
+        request_time=datetime(2022, 8, 1, hour, 30),
+        request_duration_microseconds=duration,
+        bytes_sent=bytes_sent,
+    )
+    return LogRecord("example.080122.gz", 1, entry)
+
+
+def test_performance_counter_merges_across_files():
+    first, second = PerformanceCounter(), PerformanceCounter()
+    for duration in range(1, 101):
+        first.handle(make_record(10, duration))
+    second.handle(make_record(10, 1_000, bytes_sent=None))
+    second.handle(make_record(11, 50))
+
+    report = first.merge(second).report()
+    assert report.hour.tolist() == [datetime(2022, 8, 1, 10), datetime(2022, 8, 1, 11)]
+    assert report.requests.tolist() == [101, 1]
+    assert report.bytes_sent.tolist() == [10_000, 100]
+    assert abs(report.duration_p50_us[0] - 51) <= 1
+    assert report.duration_p99_us[1] == 50
+
+
+def test_performance_counter_evicts_old_hours():
+    counter = PerformanceCounter()
+    counter.handle(make_record(10, 100))
+    counter.handle(
+        LogRecord(
+            "example.080222.gz",
+            1,
+            FakeLogEntry(
+                request_time=datetime(2022, 8, 2, 1),
+                request_duration_microseconds=100,
+                bytes_sent=100,
+            ),
+        )
+    )
+    assert counter.views == 2
+    counter.evict_before(date(2022, 8, 2))
+    assert list(counter.data) == [("example", datetime(2022, 8, 2, 1))]
+    with pytest.raises(TypeError):
+        counter.to_df()
+
+
+def test_top_k_counter_reports_most_frequent_values_per_dimension():
+    counters = [TopKCounter(), TopKCounter()]
+    for i in range(30):
+        entry = FakeLogEntry(
+            request_time=datetime(2022, 8, 1, 10),
+            request_line=f"GET /page/{i % 3} HTTP/1.1"
+            if i % 2
+            else f"GET /unique/{i} HTTP/1.1",
+            remote_host=f"10.0.0.{i % 2}",
+            headers_in={"User-Agent": "Mozilla/5.0"},
+        )
+        counters[i % 2].handle(LogRecord("example.080122.gz", i, entry))
+    report = counters[0].merge(counters[1]).report()
+    uris = report[report.dimension == "uri"].head(3)
+    assert set(uris.value) == {"/page/0", "/page/1", "/page/2"}
+    assert uris["count"].tolist() == [5, 5, 5]
+    hosts = report[report.dimension == "remote_host"]
+    assert hosts["count"].tolist() == [15, 15]
+
+
+def test_top_k_counter_views_and_eviction():
+    counter = TopKCounter()
+    for day in (1, 2):
+        for i in range(3):
+            entry = FakeLogEntry(
+                request_time=datetime(2022, 8, day, 10),
+                request_line=f"GET /page/{i} HTTP/1.1",
+                remote_host="10.0.0.1",
+                headers_in={"User-Agent": "Mozilla/5.0"},
+            )
+            counter.handle(LogRecord("example.080122.gz", i, entry))
+    assert counter.views == 6
+    counter.evict_before(date(2022, 8, 2))
+    assert counter.views == 3
+    assert {key[1] for key in counter.data} == {date(2022, 8, 2)}
+    with pytest.raises(TypeError):
+        counter.to_df()
+
+
+def test_rollup_counter_matches_acquia_counter():
+    acquia = AcquiaCounter()
+    rollups = [RollupCounter(AcquiaCounter), RollupCounter(AcquiaCounter)]
+    for i in range(200):
+        entry = FakeLogEntry(
+            request_time=datetime(2022, 8, 1 + i % 2, i % 3 * 5, i % 60),
+            request_line="GET /styles.css HTTP/1.1"
+            if i % 10 == 0
+            else f"GET /page/{i % 4} HTTP/1.1",
+            status=200,
+            remote_host=f"10.0.0.{i % 7}",
+            headers_in={"User-Agent": f"agent-{i % 3}"},
+        )
+        record = LogRecord("example.080122.gz", i, entry)
+        acquia.handle(record)
+        # split the records between two files' counters, which are then merged
+        rollups[i // 100].handle(record)
+    rollup = rollups[0].merge(rollups[1])
+    rows = list(rollup.rollups())
+
+    hourly = [row for row in rows if row["hour"] is not None]
+    assert {(row["date"], row["hour"]) for row in hourly} == {
+        (date(2022, 8, day), hour) for day in (1, 2) for hour in (0, 5, 10)
+    }
+    assert sum(row["views"] for row in hourly) == 180
+
+    daily = [row for row in rows if row["hour"] is None]
+    expected = acquia.report()
+    assert [row["date"] for row in daily] == [
+        period.to_timestamp().date() for period in expected.date
+    ]
+    assert [row["views"] for row in daily] == expected.views.tolist()
+    assert [row["hourly_visitors"] for row in daily] == expected.visits.tolist()
+    for row in daily:
+        assert row["visitors"] == 21
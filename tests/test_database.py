@@ -0,0 +1,88 @@
+from datetime import date
+
+import pandas as pd
+
+from src import database
+from src.handlers import SQLiteHandler
+from src.sketches import HyperLogLog
+
+
+def test_upsert_counts_replaces_existing_rows(tmp_path):
+    engine = database.get_engine(tmp_path / "results.db")
+    row = {"domain": "example", "counter": "acquia", "date": date(2022, 8, 1)}
+    database.upsert_counts(engine, [{**row, "visits": 1, "views": 2}])
+    database.upsert_counts(engine, [{**row, "visits": 3, "views": 4}])
+    rows = database.query_counts(engine)
+    assert len(rows) == 1
+    assert rows[0]["visits"] == 3
+    assert rows[0]["views"] == 4
+    assert rows[0]["hour"] is None
+
+
+def test_query_counts_filters_by_domain_and_date_range(tmp_path):
+    engine = database.get_engine(tmp_path / "results.db")
+    rows = [
+        {
+            "domain": domain,
+            "counter": "daily-traffic",
+            "date": date(2022, 8, day),
+            "visits": day,
+            "views": day,
+        }
+        for domain in ("a", "b")
+        for day in range(1, 5)
+    ]
+    database.upsert_counts(engine, rows)
+    results = database.query_counts(
+        engine, domains=["a"], start=date(2022, 8, 2), end=date(2022, 8, 4)
+    )
+    assert [(r["domain"], r["date"]) for r in results] == [
+        ("a", date(2022, 8, 2)),
+        ("a", date(2022, 8, 3)),
+    ]
+
+
+def test_sqlite_handler_accepts_period_dates(tmp_path):
+    handler = SQLiteHandler(tmp_path / "results.db", "acquia")
+    report = pd.DataFrame(
+        {
+            "domain": ["example"],
+            "date": [pd.Period("2022-08-01", "D")],
+            "visits": [5],
+            "views": [7],
+        }
+    )
+    handler.handle_output(report)
+    rows = database.query_counts(handler.engine, counter="acquia")
+    assert rows[0]["date"] == date(2022, 8, 1)
+    assert rows[0]["views"] == 7
+
+
+def test_rollup_report_merges_days_into_months(tmp_path):
+    engine = database.get_engine(tmp_path / "results.db")
+    rows = []
+    for day in (1, 2):
+        sketch = HyperLogLog()
+        for visitor in range(day * 10):
+            sketch.add(str(visitor))
+        rows.append(
+            {
+                "domain": "example",
+                "date": date(2022, 8, day),
+                "hour": None,
+                "views": day * 10,
+                "visitors": sketch.count(),
+                "hourly_visitors": day * 10,
+                "sketch": sketch.to_bytes(),
+            }
+        )
+    database.upsert_rollups(engine, "acquia", rows)
+    database.upsert_rollups(engine, "acquia", rows)
+
+    days = database.rollup_report(engine, "acquia", granularity="day")
+    assert [row["views"] for row in days] == [10, 20]
+    [month] = database.rollup_report(engine, "acquia", granularity="month")
+    assert month["date"] == date(2022, 8, 1)
+    assert month["views"] == 30
+    assert month["visitors"] == 20
+    assert month["hourly_visitors"] == 30
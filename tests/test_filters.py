@@ -1,6 +1,6 @@
 import pytest as pytest
 
-from src.filters import MethodFilter, UriExtensionFilter, UriFilter
+from src.filters import MethodFilter, StatusFilter, UriExtensionFilter, UriFilter
 
 from .fakes import FakeLogEntry
 
@@ -13,6 +13,7 @@ URI_TESTS = [
     ("favicon.ico?v=test", False),
     ("/home?f=favicon.ico", True),
     ("/.well-known/alfacgiapi", False),
+    ("http://[bad/", False),
 ]
 
 URI_EXTENSION_TESTS = [
@@ -21,6 +22,7 @@ URI_EXTENSION_TESTS = [
     ("/img/header.jpg", False),
     ("/robots.txt", False),
     ("/profile?id=123&type=jpg", True),
+    ("http://[bad/", False),
 ]
 
 
@@ -61,3 +63,12 @@ def test_method_filter(method: str, expected: bool):
     method_filter = MethodFilter(["GET", "POST"])
     entry = FakeLogEntry(request_line=f"{method} /home HTTP/1.2")
     assert method_filter.filter(entry) == expected
+
+
+@pytest.mark.parametrize(
+    ["status", "redirects_ok", "expected"],
+    [(200, False, True), (304, False, False), (304, True, True), (None, True, False)],
+)
+def test_status_filter(status, redirects_ok: bool, expected: bool):
+    entry = FakeLogEntry(status=status)
+    assert StatusFilter(redirects_ok=redirects_ok).filter(entry) == expected
@@ -0,0 +1,13 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize("module", ["main", "src.services", "src.tail"])
+def test_import_does_not_load_pandas(module: str):
+    code = f"import sys, {module}; assert 'pandas' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
@@ -0,0 +1,98 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from src.counters import DailyTrafficCounter
+from src.reports import ReportCollector
+from src.sampling import VisitorSampler, estimate_variance, scale_report, visitor_totals
+
+LINE = (
+    '10.0.0.{i} - - [01/Aug/2022:10:00:00 -0400] "GET {uri} HTTP/1.1" 200 512 '
+    '"https://example.com/" "Mozilla/5.0 ({i})" 1234\n'
+)
+
+
+def test_visitor_key():
+    line = LINE.format(i=1, uri="/")
+    assert VisitorSampler.visitor_key(line) == "10.0.0.1 Mozilla/5.0 (1)"
+
+
+def test_sampler_keeps_all_views_of_a_visitor():
+    sampler = VisitorSampler(0.5)
+    for i in range(100):
+        decisions = {sampler(LINE.format(i=i, uri=uri)) for uri in ("/", "/a", "/b")}
+        assert len(decisions) == 1
+
+
+def test_sampler_selects_roughly_the_sample_rate():
+    sampler = VisitorSampler(0.1)
+    selected = sum(sampler(LINE.format(i=i, uri="/")) for i in range(20_000))
+    assert selected / 20_000 == pytest.approx(0.1, abs=0.01)
+
+
+def test_sampler_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        VisitorSampler(0)
+
+
+@pytest.mark.parametrize(
+    "log_format",
+    [
+        '%h %l %u %t "%r" %s %b "%{User-agent}i" "%{Referer}i" %D',
+        '%t %h "%r" %s "%{User-agent}i"',
+        '%h %l %u %t "%r" %s %b',
+    ],
+)
+def test_sampler_rejects_formats_it_cannot_key(log_format):
+    with pytest.raises(ValueError):
+        VisitorSampler(0.5, log_format)
+
+
+def test_sampler_accepts_formats_it_can_key():
+    VisitorSampler(0.5, '%h "%r" %>s "%{user-agent}i"')
+
+
+def test_scale_report_adds_confidence_intervals():
+    report = pd.DataFrame(
+        {
+            "domain": ["a"],
+            "date": [pd.Period("2022-08-01", "D")],
+            "visits": [10],
+            "views": [20],
+        }
+    )
+    variance = pd.DataFrame(
+        {
+            "domain": ["a"],
+            "date": ["2022-08-01"],
+            "visits_var": [100.0],
+            "views_var": [400.0],
+        }
+    )
+    scaled = scale_report(report, variance, 0.5)
+    row = scaled.iloc[0]
+    assert row.visits == 20
+    assert row.views == 40
+    assert (row.visits_ci_low, row.visits_ci_high) == (0, 40)
+    assert (row.views_ci_low, row.views_ci_high) == (1, 79)
+    assert row.sample_rate == 0.5
+
+
+def test_variance_combines_visitors_across_files():
+    # the same visitor's day is split across two log files, e.g. around midnight
+    counters = [DailyTrafficCounter(), DailyTrafficCounter()]
+    for counter, views in zip(counters, (3, 4)):
+        counter.data[("a", date(2022, 8, 1), "10.0.0.1", "Mozilla/5.0")] = views
+    totals = pd.concat([visitor_totals(counter) for counter in counters])
+    variance = estimate_variance(totals, 0.5)
+    # (1 - 0.5) / 0.5^2 * (3 + 4)^2, rather than * (3^2 + 4^2)
+    assert variance.views_var.tolist() == [98.0]
+
+    collector = ReportCollector(sample_rate=0.5)
+    for counter in counters:
+        collector.add([counter])
+    [(_, report)] = collector.results()
+    row = report.iloc[0]
+    assert row.views == 14
+    assert row.views_ci_high == round(14 + 1.96 * 98**0.5)
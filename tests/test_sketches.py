@@ -0,0 +1,90 @@
+import pytest
+
+from src.sketches import DDSketch, HyperLogLog, SpaceSaving
+
+
+@pytest.mark.parametrize("n", [10, 1_000, 50_000])
+def test_hyperloglog_estimates_distinct_values(n: int):
+    sketch = HyperLogLog()
+    for i in range(n):
+        sketch.add(f"10.0.0.{i} Mozilla/5.0")
+        sketch.add(f"10.0.0.{i} Mozilla/5.0")
+    assert sketch.count() == pytest.approx(n, rel=0.05)
+
+
+def test_hyperloglog_merge_counts_union():
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(3_000):
+        a.add(str(i))
+    for i in range(2_000, 5_000):
+        b.add(str(i))
+    assert a.merge(b).count() == pytest.approx(5_000, rel=0.05)
+
+
+def test_hyperloglog_round_trips_through_bytes():
+    sketch = HyperLogLog(precision=10)
+    for i in range(100):
+        sketch.add(str(i))
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.precision == 10
+    assert restored.registers == sketch.registers
+
+
+def test_ddsketch_quantiles_are_within_relative_accuracy():
+    sketch = DDSketch(relative_accuracy=0.01)
+    values = list(range(1, 10_001))
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.95, 0.99):
+        expected = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+
+def test_ddsketch_merge_matches_single_sketch():
+    a, b, combined = DDSketch(), DDSketch(), DDSketch()
+    for value in range(1, 1_001):
+        (a if value % 2 else b).add(value)
+        combined.add(value)
+    merged = a.merge(b)
+    assert merged.count == combined.count
+    assert merged.quantile(0.95) == combined.quantile(0.95)
+
+
+def test_ddsketch_bins_are_bounded():
+    sketch = DDSketch(max_bins=64)
+    for exponent in range(300):
+        sketch.add(1.1**exponent)
+    assert len(sketch.bins) <= 64
+    assert sketch.quantile(1) == pytest.approx(1.1**299, rel=0.01)
+
+
+def test_ddsketch_empty_and_zero_values():
+    sketch = DDSketch()
+    assert sketch.quantile(0.5) is None
+    sketch.add(0)
+    assert sketch.quantile(0.5) == 0
+
+
+def test_space_saving_finds_heavy_hitters_within_error():
+    sketch = SpaceSaving(capacity=10)
+    exact = {}
+    for i in range(5_000):
+        value = f"/popular/{i % 3}" if i % 2 else f"/rare?id={i}"
+        exact[value] = exact.get(value, 0) + 1
+        sketch.add(value)
+    top = sketch.top(3)
+    assert {value for value, _, _ in top} == {f"/popular/{i}" for i in range(3)}
+    for value, count, error in top:
+        assert count - error <= exact[value] <= count
+    assert len(sketch.counts) == 10
+    assert sketch.total == 5_000
+
+
+def test_space_saving_merge():
+    a, b = SpaceSaving(capacity=5), SpaceSaving(capacity=5)
+    for value, count in [("x", 10), ("y", 5), ("z", 1)]:
+        a.add(value, count)
+    for value, count in [("y", 7), ("w", 3)]:
+        b.add(value, count)
+    assert a.merge(b).top(2) == [("y", 12, 0), ("x", 10, 0)]
+    assert a.total == 26
@@ -0,0 +1,71 @@
+import gzip
+import shutil
+
+from src.counters import DailyTrafficCounter
+from src.tail import LogFollower, LogWatcher
+
+
+def log_line(host: str, day: int = 1, uri: str = "/") -> str:
+    return (
+        f'{host} - - [{day:02d}/Aug/2022:10:00:00 -0400] "GET {uri} HTTP/1.1" 200 512 '
+        f'"-" "Mozilla/5.0" 1234\n'
+    )
+
+
+class FakeHandler:
+    def __init__(self):
+        self.outputs = []
+
+    def handle_output(self, output):
+        self.outputs.append(output)
+
+
+def test_follower_only_returns_complete_lines(tmp_path):
+    logfile = tmp_path / "example.080122"
+    logfile.write_text("first\nsec")
+    follower = LogFollower(tmp_path)
+    assert list(follower.read_lines()) == ["first"]
+    with logfile.open("a") as f:
+        f.write("ond\nthird\n")
+    assert list(follower.read_lines()) == ["second", "third"]
+    assert list(follower.read_lines()) == []
+
+
+def test_follower_finishes_rotated_file_from_gz(tmp_path):
+    logfile = tmp_path / "example.080122"
+    logfile.write_text("one\n")
+    follower = LogFollower(tmp_path)
+    assert list(follower.read_lines()) == ["one"]
+
+    # append more lines, then rotate the log to .gz and start the next day's log
+    with logfile.open("a") as f:
+        f.write("two\nthree")
+    with logfile.open("rb") as src, gzip.open(f"{logfile}.gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    logfile.unlink()
+    (tmp_path / "example.080222").write_text("four\n")
+
+    assert list(follower.read_lines()) == ["two", "three", "four"]
+
+
+def test_watcher_resumes_from_saved_state(tmp_path):
+    domain = tmp_path / "example"
+    domain.mkdir()
+    logfile = domain / "example.080122"
+    logfile.write_text(log_line("1.1.1.1") + log_line("2.2.2.2"))
+    state_file = tmp_path / "state.pickle"
+
+    handler = FakeHandler()
+    watcher = LogWatcher(domain, DailyTrafficCounter, handler, state_file)
+    assert watcher.step() == 2
+    watcher.flush()
+
+    with logfile.open("a") as f:
+        f.write(log_line("1.1.1.1", uri="/about") + log_line("3.3.3.3"))
+    restarted = LogWatcher(domain, DailyTrafficCounter, handler, state_file)
+    assert restarted.step() == 2
+    restarted.flush()
+
+    report = handler.outputs[-1]
+    assert report.visits.tolist() == [3]
+    assert report.views.tolist() == [4]
@@ -0,0 +1,135 @@
+import gzip
+import multiprocessing
+import os
+import time
+
+from config import Config
+from src.counters import DailyTrafficCounter
+from src.services import threaded_count_log_entries
+from src.workqueue import WorkQueue, run_worker
+
+
+def write_log(path, n_lines: int):
+    with gzip.open(path, "wt") as f:
+        for i in range(n_lines):
+            f.write(
+                f'10.0.0.{i % 7} - - [01/Aug/2022:{i % 24:02d}:00:00 -0400] "GET /{i % 5} HTTP/1.1" 200 512 '
+                f'"-" "Mozilla/5.0" 1234\n'
+            )
+
+
+def make_queue(tmp_path, n_files: int = 3) -> WorkQueue:
+    domain = tmp_path / "logs" / "example"
+    domain.mkdir(parents=True)
+    files = []
+    for day in range(1, n_files + 1):
+        file = domain / f"example.08{day:02d}22.gz"
+        write_log(file, 50 * day)
+        files.append(file)
+    return WorkQueue.create(tmp_path / "queue", {"example": files}, {})
+
+
+def test_claims_are_exclusive(tmp_path):
+    queue = make_queue(tmp_path, n_files=2)
+    first = queue.claim("worker-1")
+    second = WorkQueue(queue.path).claim("worker-2")
+    assert first.id != second.id
+    assert queue.claim("worker-3") is None
+
+    queue.complete(first, [])
+    assert queue.status() == {"pending": 0, "claimed": 1, "done": 1, "failed": 0}
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = make_queue(tmp_path, n_files=1)
+    job = queue.claim("dead-worker")
+    assert queue.claim("worker") is None
+
+    # pretend the claiming worker died a while ago
+    expired = time.time() - 600
+    os.utime(queue.jobs_dir / f"{job.id}.lock", (expired, expired))
+    taken = WorkQueue(queue.path, lease_seconds=300).claim("worker")
+    assert taken.id == job.id
+
+
+def test_lease_is_timed_by_the_filesystem_clock(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, n_files=1)
+    queue.claim("worker-1")
+    # a node whose clock runs an hour fast mustn't think a fresh lock has expired
+    skewed = time.time() + 3600
+    monkeypatch.setattr(time, "time", lambda: skewed)
+    assert WorkQueue(queue.path, lease_seconds=300).claim("worker-2") is None
+
+
+def test_claims_scan_the_jobs_directory_once(tmp_path, monkeypatch):
+    n_jobs = 5_000
+    files = [tmp_path / f"example.{i:06d}.gz" for i in range(n_jobs)]
+    queue = WorkQueue.create(tmp_path / "queue", {"example": files}, {})
+    for job in queue.jobs[:-10]:
+        (queue.jobs_dir / f"{job.id}.partial").touch()
+    for job in queue.jobs[-10:-5]:
+        (queue.jobs_dir / f"{job.id}.lock").touch()
+
+    calls = {"stat": 0, "scandir": 0}
+    stat, scandir = os.stat, os.scandir
+
+    def counting_stat(*args, **kwargs):
+        calls["stat"] += 1
+        return stat(*args, **kwargs)
+
+    def counting_scandir(*args, **kwargs):
+        calls["scandir"] += 1
+        return scandir(*args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", counting_stat)
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    claimed = {queue.claim(f"worker-{i}").id for i in range(5)}
+    assert claimed == {job.id for job in queue.jobs[-5:]}
+    assert queue.claim("worker-5") is None
+    assert not queue.all_finished()
+    assert calls["scandir"] == 7
+    # only the locks (and the filesystem clock probe) are stat'ed, never the finished jobs
+    assert calls["stat"] < 100
+
+
+def test_workers_resume_after_their_last_claim(tmp_path):
+    queue = make_queue(tmp_path, n_files=5)
+    first = queue.claim("worker-a")
+    second = queue.claim("worker-a")
+    assert queue.jobs.index(second) == (queue.jobs.index(first) + 1) % 5
+
+
+def test_failed_jobs_are_recorded(tmp_path):
+    queue = make_queue(tmp_path, n_files=1)
+
+    def work(job):
+        raise RuntimeError("boom")
+
+    assert queue.run(queue.claim("worker"), work) is False
+    [(job, error)] = queue.errors()
+    assert "boom" in error
+    assert queue.claim("worker") is None
+
+
+def test_workers_in_several_processes(tmp_path):
+    queue = make_queue(tmp_path, n_files=4)
+    args = (queue, [DailyTrafficCounter], Config.LOG_FORMAT)
+    processes = [
+        multiprocessing.Process(target=run_worker, args=args) for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    assert queue.status()["done"] == 4
+
+    merged = DailyTrafficCounter()
+    for [counter] in queue.results("example"):
+        merged.merge(counter)
+    expected = DailyTrafficCounter()
+    for job in queue.jobs:
+        [counter] = threaded_count_log_entries(
+            job.file, Config.LOG_FORMAT, [DailyTrafficCounter]
+        )
+        expected.merge(counter)
+    assert merged.data == expected.data